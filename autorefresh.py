@@ -0,0 +1,204 @@
+# autorefresh.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+# Refresh of the city on the forecast screen. Its current weather and
+# daily forecast are fetched again every WEATHER_REFRESH minutes, 10 by
+# default, while the activity is visible. WEATHER_REFRESH=0 turns the
+# refresh off.
+
+from gi.repository import GLib
+
+import os
+import math
+import time
+import logging
+import fastjson
+import openweathermap
+import requestmanager
+
+_logger = logging.getLogger('weather-activity')
+
+REFRESH_INTERVAL = int(os.environ.get('WEATHER_REFRESH', '10')) * 60
+
+# seconds between two observations of a city, no newer data exists
+# before the time of the last one plus this
+UPDATE_INTERVAL = 10 * 60
+
+# seconds the API takes to publish an observation
+PUBLISH_DELAY = 60
+
+def get_next_refresh(date, last, interval):
+    """Return when to fetch data observed at date and fetched at last."""
+    next = last + interval
+    if date is not None:
+        next = max(next, date + UPDATE_INTERVAL + PUBLISH_DELAY)
+    return next
+
+class AutoRefresh(object):
+    """Keep the city shown on the forecast screen up to date.
+
+    The current weather is fetched past the response cache, since its
+    copy can be as old as the TTL, and the daily forecast, and the hourly
+    one once it was shown, when the cache no longer has them. The requests are background ones at low priority,
+    so they take from the rate limit budget only what the user leaves.
+    """
+
+    def __init__(self, activity, interval=REFRESH_INTERVAL):
+        self.activity = activity
+        self.interval = interval
+        self.city = None
+        # set by the activity when it is shown
+        self.visible = False
+        self.last_refresh = None
+        self.refreshes = 0
+
+        self._requests = []
+        self._timeout_id = None
+
+    def watch(self, city):
+        """Refresh a city just fetched from now on, or none if it is None."""
+        if city is not self.city:
+            self._cancel()
+            self.city = city
+        self.last_refresh = time.time()
+        self.schedule()
+
+    def set_visible(self, visible):
+        if visible == self.visible:
+            return
+        self.visible = visible
+        if visible:
+            self.schedule()
+        else:
+            self._cancel()
+            self._remove_timeout()
+
+    def schedule(self):
+        """Set the timeout of the next refresh, if one is wanted."""
+        self._remove_timeout()
+        if self.city is None or not self.visible or not self.interval or \
+                self._requests:
+            return
+
+        next = get_next_refresh(self.city.date, self.last_refresh,
+                                self.interval)
+        delay = max(0, int(math.ceil(next - time.time())))
+        self._timeout_id = GLib.timeout_add_seconds(delay,
+                                                    self._refresh_timeout_cb)
+        _logger.debug('refresh of %s in %ds' % (self.city.name, delay))
+
+    def _refresh_timeout_cb(self):
+        self._timeout_id = None
+        self.refresh()
+        return False
+
+    def refresh(self):
+        city = self.city
+        self.last_refresh = time.time()
+        self.refreshes += 1
+
+        source = openweathermap.get_group_sources([city.id])[0]
+        self._add(source, self._parse_current, self._current_complete)
+
+        source = openweathermap.get_daily_source(city.id)
+        if not self.activity.response_cache.contains(source):
+            self._add(source, self._parse_daily, self._daily_complete)
+
+        source = openweathermap.get_hourly_source(city.id)
+        if len(city.forecast_hourly) and \
+                not self.activity.response_cache.contains(source):
+            self._add(source, self._parse_hourly, self._hourly_complete)
+
+    def _add(self, source, parse, callback):
+        request = self.activity.requests.add(
+            source, callback, self._error,
+            priority=requestmanager.PRIORITY_LOW, background=True,
+            parse=parse)
+        self._requests.append(request)
+
+    def _cancel(self):
+        for request in self._requests:
+            self.activity.requests.cancel(request)
+        self._requests = []
+
+    def _remove_timeout(self):
+        if self._timeout_id is not None:
+            GLib.source_remove(self._timeout_id)
+            self._timeout_id = None
+
+    def _load(self, request, text):
+        # runs on the parse thread
+        data = fastjson.loads(text)
+        if str(data.get('cod', 200)) != '200':
+            return None
+        self.activity.response_cache.put(request.source, text)
+        return data
+
+    def _parse_current(self, request, text):
+        data = self._load(request, text)
+        if data is None:
+            return None
+        cities = openweathermap.load_cities(data)
+        if not cities:
+            return None
+        return cities[0]
+
+    def _parse_daily(self, request, text):
+        data = self._load(request, text)
+        if data is None:
+            return None
+        return openweathermap.load_forecast_daily(data['list'])
+
+    def _parse_hourly(self, request, text):
+        data = self._load(request, text)
+        if data is None:
+            return None
+        return openweathermap.load_forecast_hourly(data['list'])
+
+    def _current_complete(self, request, city):
+        if city is not None:
+            if city.date != self.city.date:
+                _logger.debug('%s observed at %s' % (city.name, city.date))
+            self.city.update(city)
+        self._complete(request)
+
+    def _daily_complete(self, request, series):
+        if series is not None:
+            self.city.forecast_daily = series
+        self._complete(request)
+
+    def _hourly_complete(self, request, series):
+        if series is not None:
+            self.city.forecast_hourly = series
+        self._complete(request)
+
+    def _error(self, request, message):
+        # the next refresh tries again
+        _logger.debug('refresh of %s failed: %s' % (request.source, message))
+        self._requests.remove(request)
+        self.schedule()
+
+    def _complete(self, request):
+        self._requests.remove(request)
+        forecast_screen = self.activity.forecast_screen
+        if self.activity.get_canvas() is forecast_screen:
+            forecast_screen.display_results()
+        self.schedule()
@@ -0,0 +1,93 @@
+# bench_cityindex.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+# Prefix lookup latency of the offline city index over a synthetic list
+# of 200k cities.
+#
+#     python benchmarks/bench_cityindex.py [count]
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cityindex
+
+SYLLABLES = ['ba', 'ber', 'ca', 'don', 'el', 'fort', 'gra', 'ham', 'is',
+             'ka', 'lon', 'mar', 'no', 'os', 'par', 'ro', 'san', 'ton',
+             'u', 'vi', 'wa', 'yo', 'za']
+
+def make_cities(count, seed=4711):
+    rand = random.Random(seed)
+    for id in xrange(count):
+        name = ''.join([rand.choice(SYLLABLES)
+                        for i in range(rand.randint(2, 4))])
+        yield (id, name.capitalize(), rand.choice(['GB', 'FR', 'PE', 'US']),
+               rand.uniform(-90, 90), rand.uniform(-180, 180))
+
+def run(count=200000, lookups=20000):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, cityindex.INDEX_FILE)
+
+        start = time.time()
+        cityindex.build(make_cities(count), path)
+        build_time = time.time() - start
+
+        start = time.time()
+        index = cityindex.load(path)
+        load_time = time.time() - start
+
+        rand = random.Random(0)
+        prefixes = [''.join([rand.choice(SYLLABLES)
+                             for i in range(rand.randint(1, 3))])
+                    for i in range(lookups)]
+
+        results = {}
+        for length in (1, 2, 3):
+            subset = [prefix for prefix in prefixes
+                      if len(prefix) >= length * 2]
+            start = time.time()
+            for prefix in subset:
+                index.lookup(prefix)
+            elapsed = time.time() - start
+            results['lookup_us_%d_syllables' % (length)] = \
+                elapsed / len(subset) * 1e6
+
+        results.update({'cities': count,
+                        'index_bytes': os.path.getsize(path),
+                        'build_s': build_time,
+                        'load_s': load_time})
+        index.close()
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    count = 200000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    for key, value in sorted(run(count).items()):
+        sys.stdout.write('%s: %s\n' % (key, value))
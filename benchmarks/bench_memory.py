@@ -0,0 +1,161 @@
+# bench_memory.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+# Memory held by the forecast models: the columnar ForecastSeries and
+# the __slots__ City against the list of dictionaries and plain object
+# they replaced.
+#
+#     python benchmarks/bench_memory.py [cities]
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import openweathermap
+
+HOURLY_STEPS = 40
+
+CODES = [800, 801, 802, 500, 501, 600]
+
+def make_city(id, rand):
+    return {'id': id, 'name': u'City %d' % (id), 'dt': 1381000000,
+            'url': u'http://openweathermap.org/city/%d' % (id),
+            'sys': {'country': u'GB'},
+            'weather': [{'id': rand.choice(CODES), 'icon': u'01d'}],
+            'clouds': {'all': rand.randint(0, 100)},
+            'wind': {'speed': rand.uniform(0, 20)},
+            'main': {'temp': rand.uniform(250, 310),
+                     'temp_max': rand.uniform(250, 310),
+                     'temp_min': rand.uniform(250, 310),
+                     'pressure': rand.uniform(990, 1030),
+                     'humidity': rand.randint(0, 100)}}
+
+def make_hourly(rand):
+    steps = []
+    for i in range(HOURLY_STEPS):
+        steps.append({'dt': 1381000000 + i * 10800,
+                      'weather': [{'id': rand.choice(CODES),
+                                   'icon': u'%02dd' % (rand.randint(1, 4))}],
+                      'clouds': {'all': rand.randint(0, 100)},
+                      'wind': {'speed': rand.uniform(0, 20),
+                               'deg': rand.uniform(0, 360)},
+                      'main': {'temp': rand.uniform(250, 310),
+                               'temp_max': rand.uniform(250, 310),
+                               'temp_min': rand.uniform(250, 310),
+                               'pressure': rand.uniform(990, 1030),
+                               'humidity': rand.randint(0, 100)}})
+    return steps
+
+def get_value(dict, key):
+    """Read a field the way the models did before ForecastSeries."""
+    return openweathermap.encode(dict.get(key))
+
+def load_hourly_dicts(steps):
+    """The list of dictionaries built before ForecastSeries."""
+    forecast = []
+    for key in steps:
+        forecast.append({
+            'clouds' : get_value(key['clouds'], 'all'),
+            'icon' : get_value(key['weather'][0], 'icon'),
+            'weather_code' : get_value(key['weather'][0], 'id'),
+            'weather' : openweathermap.get_condition(
+                get_value(key['weather'][0], 'id')),
+            'date' : get_value(key, 'dt'),
+            'temp' : get_value(key['main'], 'temp'),
+            'temp_max' : get_value(key['main'], 'temp_max'),
+            'temp_min' : get_value(key['main'], 'temp_min'),
+            'wind_speed' : get_value(key['wind'], 'speed'),
+            'wind_deg' : get_value(key['wind'], 'deg'),
+            'pressure' : get_value(key['main'], 'pressure'),
+            'humidity' : get_value(key['main'], 'humidity')})
+    return forecast
+
+class DictCity(object):
+    """City without __slots__, as it was."""
+
+    def __init__(self, city):
+        for name in openweathermap.City.__slots__:
+            setattr(self, name.lstrip('_'), getattr(city, name))
+
+def deep_size(obj, seen=None):
+    """Return the bytes held by obj and everything it references."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += deep_size(item, seen)
+    elif hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    elif hasattr(obj, '__slots__'):
+        for name in obj.__slots__:
+            if hasattr(obj, name):
+                size += deep_size(getattr(obj, name), seen)
+    return size
+
+def run(count=100):
+    rand = random.Random(4711)
+    cities = [make_city(id, rand) for id in range(count)]
+    hourly = [make_hourly(rand) for id in range(count)]
+
+    # the strings shared by both layouts are counted once up front
+    shared = set()
+    deep_size(openweathermap.get_condition(800), shared)
+
+    slot_cities = [openweathermap.City(info) for info in cities]
+    for city, steps in zip(slot_cities, hourly):
+        city.load_forecast_hourly(steps)
+        city.forecast_daily = None
+    dict_cities = [DictCity(city) for city in slot_cities]
+    for city in dict_cities:
+        city.forecast_hourly = None
+
+    series = [city.forecast_hourly for city in slot_cities]
+    dicts = [load_hourly_dicts(steps) for steps in hourly]
+
+    for city in slot_cities:
+        city.forecast_hourly = None
+
+    results = {
+        'cities': count,
+        'hourly_steps': HOURLY_STEPS,
+        'hourly_dicts_bytes': deep_size(dicts, set(shared)),
+        'hourly_series_bytes': deep_size(series, set(shared)),
+        'city_dict_bytes': deep_size(dict_cities, set(shared)),
+        'city_slots_bytes': deep_size(slot_cities, set(shared)),
+    }
+    return results
+
+if __name__ == '__main__':
+    count = 100
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    for key, value in sorted(run(count).items()):
+        sys.stdout.write('%s: %s\n' % (key, value))
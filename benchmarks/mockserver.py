@@ -0,0 +1,297 @@
+# mockserver.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+# Local stand-in for the OpenWeatherMap API, serving the find, group,
+# box/city, forecast/daily and forecast endpoints from
+# benchmarks/fixtures, with latency, bandwidth and failure injection.
+# Start it with, for example
+#
+#     python benchmarks/mockserver.py --latency 800 --bandwidth 4000
+#
+# and run the activity with WEATHER_API_URL=http://localhost:8000/data/2.5/
+#
+# With --record URL the requests are forwarded to URL and the responses
+# saved to the --replay directory; with --replay alone they are served
+# back from it.
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import urllib2
+import hashlib
+import argparse
+import threading
+import SocketServer
+import BaseHTTPServer
+
+from urlparse import urlparse, parse_qs
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+
+sys.path.insert(0, ROOT)
+
+import responsecache
+
+API_PATH = '/data/2.5/'
+
+HTML_ERROR = '<html><head><title>502 Bad Gateway</title></head><body>' \
+             '<h1>502 Bad Gateway</h1></body></html>'
+
+def load_fixture(name):
+    data = open(os.path.join(FIXTURES, name + '.json'), 'r')
+    try:
+        return json.loads(data.read())
+    finally:
+        data.close()
+
+class Fixtures(object):
+    """Build endpoint responses from the recorded fixtures."""
+
+    def __init__(self):
+        self.cities = load_fixture('find_50')['list']
+        self.daily = load_fixture('daily_16')
+        self.hourly = load_fixture('hourly_40')
+
+    def find(self, params):
+        q = params.get('q', [''])[0].lower()
+        cities = [city for city in self.cities
+                  if city['name'].lower().startswith(q)]
+        return {'message': 'like', 'cod': '200', 'count': len(cities),
+                'list': cities}
+
+    def group(self, params):
+        ids = [int(id) for id in params.get('id', [''])[0].split(',') if id]
+        cities = []
+        for i, id in enumerate(ids):
+            city = dict(self.cities[i % len(self.cities)])
+            city['id'] = id
+            cities.append(city)
+        return {'cnt': len(cities), 'list': cities}
+
+    def box(self, params):
+        bbox = params.get('bbox', ['-180,-90,180,90'])[0].split(',')
+        west, south, east, north = [float(value) for value in bbox[:4]]
+        cities = [city for city in self.cities
+                  if west <= city['coord']['lon'] <= east and
+                  south <= city['coord']['lat'] <= north]
+        return {'cod': '200', 'calctime': 0.01, 'cnt': len(cities),
+                'list': cities}
+
+    def forecast_daily(self, params):
+        count = int(params.get('cnt', ['7'])[0])
+        response = dict(self.daily)
+        response['list'] = self.daily['list'][:count]
+        response['cnt'] = len(response['list'])
+        return response
+
+    def forecast(self, params):
+        return self.hourly
+
+    def get(self, endpoint, params):
+        handler = {'find': self.find,
+                   'group': self.group,
+                   'box/city': self.box,
+                   'forecast/daily': self.forecast_daily,
+                   'forecast': self.forecast}.get(endpoint)
+        if handler is None:
+            return None
+        return json.dumps(handler(params))
+
+class Recorder(object):
+    """Forward requests to a real server and keep the responses on disk."""
+
+    def __init__(self, directory, upstream=None):
+        self.directory = directory
+        self.upstream = upstream
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _get_path(self, source):
+        # the APPID is left out of the key so recordings can be shared
+        source = '&'.join([param for param in source.split('&')
+                           if not param.startswith('APPID=')])
+        key = hashlib.sha1(responsecache.normalize(source)).hexdigest()
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, source):
+        path = self._get_path(source)
+        if self.upstream is not None:
+            text = urllib2.urlopen(self.upstream + source).read()
+            output = open(path, 'w')
+            try:
+                output.write(text)
+            finally:
+                output.close()
+            return text
+
+        if not os.path.exists(path):
+            return None
+        data = open(path, 'r')
+        try:
+            return data.read()
+        finally:
+            data.close()
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keep connections alive like the real API does
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        options = self.server.options
+        rand = self.server.random
+
+        delay = options.latency + rand.uniform(0, options.jitter)
+        time.sleep(delay / 1000.0)
+
+        url = urlparse(self.path)
+        if not url.path.startswith(API_PATH):
+            self.send_body(404, 'text/plain', 'not found')
+            return
+        endpoint = url.path[len(API_PATH):]
+        source = '%s?%s' % (endpoint, url.query)
+
+        if rand.random() < options.html_errors:
+            self.send_body(502, 'text/html', HTML_ERROR)
+            return
+
+        if rand.random() < options.cod_errors:
+            body = json.dumps({'cod': options.cod, 'message': 'injected'})
+            self.send_body(200, 'application/json; charset=utf-8', body)
+            return
+
+        text = None
+        if self.server.recorder is not None:
+            text = self.server.recorder.get(source)
+        if text is None:
+            text = self.server.fixtures.get(endpoint, parse_qs(url.query))
+        if text is None:
+            body = json.dumps({'cod': '404', 'message': 'unknown endpoint'})
+            self.send_body(404, 'application/json; charset=utf-8', body)
+            return
+
+        truncate = rand.random() < options.truncate
+        self.send_body(200, 'application/json; charset=utf-8', text,
+                       truncate)
+
+    def send_body(self, status, content_type, body, truncate=False):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if truncate:
+            # announce the whole body but stop half way and hang up
+            body = body[:len(body) / 2]
+            self.close_connection = 1
+
+        bandwidth = self.server.options.bandwidth
+        chunk_size = 4096
+        if bandwidth:
+            chunk_size = max(1, min(chunk_size, bandwidth / 10))
+        try:
+            for start in range(0, len(body), chunk_size):
+                self.wfile.write(body[start:start + chunk_size])
+                if bandwidth:
+                    time.sleep(float(chunk_size) / bandwidth)
+            self.wfile.flush()
+        except socket.error:
+            self.close_connection = 1
+
+    def log_message(self, format, *args):
+        if not self.server.options.quiet:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, options):
+        BaseHTTPServer.HTTPServer.__init__(self, (options.host, options.port),
+                                           Handler)
+        self.options = options
+        self.fixtures = Fixtures()
+        self.random = random.Random(options.seed)
+        self.recorder = None
+        if options.replay:
+            self.recorder = Recorder(options.replay, options.record)
+
+    def get_url(self):
+        host, port = self.server_address
+        return 'http://%s:%d%s' % (host, port, API_PATH)
+
+    def start(self):
+        """Serve from a background thread, for use in benchmarks."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Mock OpenWeatherMap API')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds before each response')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='random extra milliseconds of latency')
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help='bytes per second, 0 for unlimited')
+    parser.add_argument('--truncate', type=float, default=0,
+                        help='fraction of bodies cut short')
+    parser.add_argument('--html-errors', type=float, default=0,
+                        help='fraction of requests answered by an HTML '
+                             'error page')
+    parser.add_argument('--cod-errors', type=float, default=0,
+                        help='fraction of requests answered with a '
+                             'non-200 cod')
+    parser.add_argument('--cod', default='404',
+                        help='cod value of the injected errors')
+    parser.add_argument('--record', metavar='URL',
+                        help='forward requests to URL, e.g. '
+                             'http://api.openweathermap.org/data/2.5/, '
+                             'and save the responses to --replay')
+    parser.add_argument('--replay', metavar='DIR',
+                        help='directory of recorded responses')
+    parser.add_argument('--seed', type=int, default=4711)
+    parser.add_argument('--quiet', action='store_true')
+    return parser
+
+def main(argv):
+    options = get_parser().parse_args(argv[1:])
+    if options.record and not options.replay:
+        sys.stderr.write('--record needs a --replay directory\n')
+        return 1
+
+    server = MockServer(options)
+    sys.stdout.write('serving %s\n' % (server.get_url()))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,462 @@
+# run.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+# Headless benchmark suite. Replays the OpenWeatherMap responses in
+# benchmarks/fixtures through the models, the temperature conversion and,
+# when GTK can be initialized, the tree view update paths. With GLib it
+# also measures the main loop stalls while responses from
+# benchmarks/mockserver.py are handled, and the CPU time of a request
+# before and after the request manager. The results are written as JSON
+# so runs from different releases can be compared.
+#
+#     python benchmarks/run.py [--quick] [--output results.json]
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fastjson
+import temperature
+import openweathermap
+
+FIND_FIXTURES = ['find_1', 'find_10', 'find_50', 'group_20']
+DAILY_FIXTURES = ['daily_7', 'daily_16']
+HOURLY_FIXTURES = ['hourly_40']
+
+# shortest total time of one timing run, in seconds
+MIN_RUN_TIME = 0.05
+
+def load_file(path):
+    data = open(path, 'r')
+    try:
+        return data.read()
+    finally:
+        data.close()
+
+def load_fixture(name):
+    return load_file(os.path.join(FIXTURES, name + '.json'))
+
+def measure(func, repeat=5):
+    """Time func, calling it enough times per run to get a stable figure.
+
+    Returns the best and median seconds per call over repeat runs.
+    """
+    number = 1
+    while True:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= MIN_RUN_TIME:
+            break
+        number *= 10
+
+    times = [elapsed / number]
+    for run in range(repeat - 1):
+        start = time.time()
+        for i in xrange(number):
+            func()
+        times.append((time.time() - start) / number)
+    times.sort()
+    return {'best_s': times[0], 'median_s': times[len(times) / 2],
+            'calls': number}
+
+def get_city(name='find_1'):
+    return openweathermap.load_cities(json.loads(load_fixture(name)))[0]
+
+def bench_models(results, repeat):
+    backend, loads = fastjson.get_backend()
+    results['decode.backend'] = backend
+
+    for name in FIND_FIXTURES + HOURLY_FIXTURES:
+        text = load_fixture(name)
+        results['decode.%s' % (name)] = measure(
+            lambda: json.loads(text), repeat)
+        results['decode_%s.%s' % (backend, name)] = measure(
+            lambda: loads(text), repeat)
+
+    for name in FIND_FIXTURES:
+        data = json.loads(load_fixture(name))
+        results['cities.%s' % (name)] = measure(
+            lambda: openweathermap.load_cities(data), repeat)
+
+    city = get_city()
+    for name in DAILY_FIXTURES:
+        steps = json.loads(load_fixture(name))['list']
+        results['load_forecast_daily.%s' % (name)] = measure(
+            lambda: city.load_forecast_daily(steps), repeat)
+
+    for name in HOURLY_FIXTURES:
+        steps = json.loads(load_fixture(name))['list']
+        results['load_forecast_hourly.%s' % (name)] = measure(
+            lambda: city.load_forecast_hourly(steps), repeat)
+
+def bench_convert(results, repeat):
+    city = get_city()
+    city.load_forecast_hourly(json.loads(load_fixture('hourly_40'))['list'])
+    series = city.forecast_hourly
+    temps = list(series.columns['temp'])
+
+    try:
+        import weather
+        activity = weather.WeatherActivity.__new__(weather.WeatherActivity)
+        activity.temp_scale = temperature.FAHRENHEIT
+        convert = activity.convert
+        name = 'WeatherActivity.convert.hourly_40'
+    except ImportError:
+        # without sugar3 time the function WeatherActivity.convert calls
+        convert = lambda kelvin: temperature.convert(kelvin,
+                                                     temperature.FAHRENHEIT)
+        name = 'temperature.convert.hourly_40'
+
+    results[name] = measure(lambda: [convert(temp) for temp in temps],
+                            repeat)
+
+    def convert_column():
+        series._converted.clear()
+        series.converted('temp', temperature.FAHRENHEIT)
+
+    results['ForecastSeries.converted.hourly_40'] = measure(convert_column,
+                                                            repeat)
+    results['ForecastSeries.converted.cached'] = measure(
+        lambda: series.converted('temp', temperature.FAHRENHEIT), repeat)
+
+class FakeActivity(object):
+    """The parts of WeatherActivity the tree views use."""
+
+    wind_scale = 'm/s'
+    pressure_scale = 'hPa'
+    humidity_scale = '%'
+    cloud_scale = '%'
+    temp_scale = temperature.CELSIUS
+
+    def convert(self, kelvin):
+        return temperature.convert(kelvin, self.temp_scale)
+
+    def select_city(self, city):
+        pass
+
+def init_gtk():
+    """Return Gtk if it can be initialized, or a reason why not."""
+    try:
+        import gi
+        gi.require_version('Gtk', '3.0')
+        from gi.repository import Gtk
+    except (ImportError, ValueError) as error:
+        return None, 'no GTK: %s' % (error)
+    if not Gtk.init_check(sys.argv)[0]:
+        return None, 'GTK could not open a display'
+    return Gtk, None
+
+def bench_views(results, repeat):
+    Gtk, reason = init_gtk()
+    if Gtk is None:
+        results['views'] = {'skipped': reason}
+        return
+
+    # the icons are loaded relative to the bundle
+    os.chdir(ROOT)
+    import searchscreen
+    try:
+        import forecastscreen
+    except ImportError as error:
+        forecastscreen = None
+        results['views.daily'] = {'skipped': 'no sugar3: %s' % (error)}
+
+    activity = FakeActivity()
+
+    def flush():
+        while Gtk.events_pending():
+            Gtk.main_iteration()
+
+    def render(treeview, update):
+        window = Gtk.OffscreenWindow()
+        window.set_default_size(1200, 900)
+        window.add(treeview)
+        window.show_all()
+        flush()
+
+        def run():
+            update()
+            treeview.queue_draw()
+            flush()
+        return run
+
+    for name in FIND_FIXTURES:
+        cities = openweathermap.load_cities(json.loads(load_fixture(name)))
+        treeview = searchscreen.SearchTreeView(activity)
+        results['SearchTreeView.update.%s' % (name)] = measure(
+            render(treeview, lambda: treeview.update(cities)), repeat)
+        results['SearchTreeView.update_temperatures.%s' % (name)] = measure(
+            render(treeview, treeview.update_temperatures), repeat)
+
+    if forecastscreen is None:
+        return
+
+    for name in DAILY_FIXTURES:
+        city = get_city()
+        city.load_forecast_daily(json.loads(load_fixture(name))['list'])
+        treeview = forecastscreen.ForecastDailyTreeView(activity)
+        results['ForecastDailyTreeView.update.%s' % (name)] = measure(
+            render(treeview, lambda: treeview.update(city)), repeat)
+
+# milliseconds between two ticks of the main loop heartbeat
+HEARTBEAT = 5
+
+def bench_stall(results, quick):
+    """Measure how long the main loop stalls while responses are handled.
+
+    Requests go to benchmarks/mockserver.py and the responses are turned
+    into models either in the main loop callback, as the activity used
+    to, or on the parse thread of the request manager. A heartbeat timer
+    records how late it runs.
+    """
+    try:
+        from gi.repository import GLib
+        import requestmanager
+    except ImportError as error:
+        results['stall'] = {'skipped': 'no GLib: %s' % (error)}
+        return
+
+    import mockserver
+    options = mockserver.get_parser().parse_args(['--port', '0', '--quiet'])
+    server = mockserver.MockServer(options)
+    server.start()
+
+    sources = ['find?q=Lon&type=like&mode=json',
+               'forecast?id=2643743&mode=json'] * 10
+    if quick:
+        sources = sources[:4]
+    # the request manager would share one download between repeats
+    sources = ['%s&n=%d' % (source, index)
+               for index, source in enumerate(sources)]
+
+    def build(text):
+        data = json.loads(text)
+        if 'city' in data:
+            return openweathermap.load_forecast_hourly(data['list'])
+        return openweathermap.load_cities(data)
+
+    def run(on_worker):
+        # the rate limit would time the budget instead of the parsing
+        manager = requestmanager.RequestManager(server.get_url(),
+                                                rate_limit=0)
+        loop = GLib.MainLoop()
+        pending = [len(sources)]
+        errors = []
+        stalls = []
+        last = [time.time()]
+
+        def heartbeat():
+            now = time.time()
+            stalls.append(max(0.0, now - last[0] - HEARTBEAT / 1000.0))
+            last[0] = now
+            return True
+
+        def count_down():
+            pending[0] -= 1
+            if not pending[0]:
+                loop.quit()
+
+        def done(request, result):
+            if not on_worker:
+                build(result)
+            count_down()
+
+        def error(request, message):
+            errors.append(message)
+            count_down()
+
+        parse = None
+        if on_worker:
+            parse = lambda request, text: build(text)
+        for source in sources:
+            manager.add(source, done, error, parse=parse)
+
+        heartbeat_id = GLib.timeout_add(HEARTBEAT, heartbeat)
+        loop.run()
+        GLib.source_remove(heartbeat_id)
+
+        stalls.sort()
+        return {'max_ms': stalls[-1] * 1000 if stalls else 0.0,
+                'p95_ms': stalls[int(0.95 * (len(stalls) - 1))] * 1000
+                          if stalls else 0.0,
+                'total_ms': sum(stalls) * 1000,
+                'errors': len(errors)}
+
+    results['stall.main_loop_parse'] = run(False)
+    results['stall.worker_parse'] = run(True)
+    server.shutdown()
+
+def bench_download(results, quick):
+    """Compare the CPU time of a request before and after the manager.
+
+    The activity used to read a response 32 bytes at a time into a file
+    and decode the file once it was complete. The request manager reads
+    it in memory in large chunks on a worker and decodes it on the parse
+    thread. Both are measured on the thread doing the work.
+    """
+    try:
+        from gi.repository import GLib
+        import requestmanager
+    except ImportError as error:
+        results['download'] = {'skipped': 'no GLib: %s' % (error)}
+        return
+
+    import timing
+    if timing.thread_time() is None:
+        results['download'] = {'skipped': 'no thread CPU time'}
+        return
+
+    import urllib2
+    import tempfile
+    import mockserver
+    options = mockserver.get_parser().parse_args(['--port', '0', '--quiet'])
+    server = mockserver.MockServer(options)
+    server.start()
+
+    sources = ['find?q=Lon&type=like&mode=json',
+               'forecast?id=2643743&mode=json'] * 10
+    if quick:
+        sources = sources[:4]
+    sources = ['%s&n=%d' % (source, index)
+               for index, source in enumerate(sources)]
+
+    def summary(times):
+        times.sort()
+        return {'median_ms': times[len(times) / 2] * 1000,
+                'total_ms': sum(times) * 1000,
+                'requests': len(times)}
+
+    def run_file():
+        times = []
+        for source in sources:
+            start = timing.thread_time()
+            response = urllib2.urlopen(server.get_url() + source)
+            handle, path = tempfile.mkstemp()
+            dest = os.fdopen(handle, 'w')
+            try:
+                while True:
+                    data = response.read(32)
+                    if not data:
+                        break
+                    dest.write(data)
+            finally:
+                dest.close()
+                response.close()
+            try:
+                json.loads(load_file(path))
+            finally:
+                os.remove(path)
+            times.append(timing.elapsed(start))
+        return summary(times)
+
+    def run_manager():
+        manager = requestmanager.RequestManager(server.get_url(),
+                                                rate_limit=0)
+        loop = GLib.MainLoop()
+        pending = [len(sources)]
+        times = []
+        errors = []
+
+        def count_down():
+            pending[0] -= 1
+            if not pending[0]:
+                loop.quit()
+
+        def done(request, result):
+            times.append(request.fetch_cpu + request.parse_cpu)
+            count_down()
+
+        def error(request, message):
+            errors.append(message)
+            count_down()
+
+        for source in sources:
+            manager.add(source, done, error,
+                        parse=lambda request, text: json.loads(text))
+        loop.run()
+        result = summary(times)
+        result['errors'] = len(errors)
+        return result
+
+    results['download.file_32'] = run_file()
+    results['download.manager'] = run_manager()
+    server.shutdown()
+
+def bench_cityindex(results, quick):
+    import bench_cityindex
+    count = 200000
+    if quick:
+        count = 20000
+    results['cityindex'] = bench_cityindex.run(count, lookups=2000)
+
+def bench_memory(results, quick):
+    import bench_memory
+    results['memory'] = bench_memory.run(100)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Weather benchmarks')
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer runs and a smaller city index')
+    parser.add_argument('--output', help='write the JSON results here')
+    args = parser.parse_args(argv[1:])
+
+    repeat = 5
+    if args.quick:
+        repeat = 3
+
+    results = {}
+    bench_models(results, repeat)
+    bench_convert(results, repeat)
+    bench_views(results, repeat)
+    bench_stall(results, args.quick)
+    bench_download(results, args.quick)
+    bench_cityindex(results, args.quick)
+    bench_memory(results, args.quick)
+
+    report = {'time': int(time.time()),
+              'python': platform.python_version(),
+              'machine': platform.machine(),
+              'results': results}
+    text = json.dumps(report, indent=1, sort_keys=True)
+
+    if args.output:
+        output = open(args.output, 'w')
+        try:
+            output.write(text + '\n')
+        finally:
+            output.close()
+    else:
+        sys.stdout.write(text + '\n')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,236 @@
+# cityindex.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+# Offline index of city names for prefix search.
+#
+# The index is built once from an OpenWeatherMap city list with
+#
+#     python cityindex.py city.list.json cities.idx
+#
+# and is memory mapped by the activity. Entries are sorted by their
+# normalized name, so a prefix lookup is a binary search, and the key
+# lengths of the matching range rank them. The file layout is
+#
+#     header   '<4sI'   magic, number of cities
+#     ids      '<I'     one per city
+#     coords   '<ff'    lat, lon per city
+#     lengths  '<H'     key length per city
+#     offsets  '<I'     one per city plus one, into the string blob
+#     blob              key \0 name \0 country, per city
+
+import os
+import sys
+import mmap
+import json
+import bisect
+import heapq
+import struct
+import logging
+import unicodedata
+
+from collections import namedtuple
+
+_logger = logging.getLogger('weather-activity')
+
+INDEX_FILE = 'cities.idx'
+
+MAGIC = 'WCI2'
+HEADER = struct.Struct('<4sI')
+ID = struct.Struct('<I')
+COORD = struct.Struct('<ff')
+LENGTH = struct.Struct('<H')
+OFFSET = struct.Struct('<I')
+
+CityEntry = namedtuple('CityEntry', 'id name country lat lon')
+
+def normalize(name):
+    """Return the lowercase, accent free utf-8 key of a city name."""
+    if not isinstance(name, unicode):
+        name = name.decode('utf-8')
+    name = unicodedata.normalize('NFKD', name.lower())
+    name = ''.join([c for c in name if not unicodedata.combining(c)])
+    return ' '.join(name.split()).encode('utf-8')
+
+class _Keys(object):
+    """Sequence view of the sorted keys, for bisect."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.index.get_key(i)
+
+class CityIndex(object):
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a city index' % (path))
+
+        self._ids = HEADER.size
+        self._coords = self._ids + ID.size * self.count
+        self._lengths = self._coords + COORD.size * self.count
+        self._offsets = self._lengths + LENGTH.size * self.count
+        self._blob = self._offsets + OFFSET.size * (self.count + 1)
+
+        self._keys = _Keys(self)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _get_strings(self, i):
+        start, end = struct.unpack_from('<II', self._map,
+                                        self._offsets + OFFSET.size * i)
+        return self._map[self._blob + start:self._blob + end].split('\0')
+
+    def get_key(self, i):
+        start, end = struct.unpack_from('<II', self._map,
+                                        self._offsets + OFFSET.size * i)
+        blob = self._blob
+        return self._map[blob + start:self._map.find('\0', blob + start,
+                                                     blob + end)]
+
+    def get_entry(self, i):
+        key, name, country = self._get_strings(i)
+        id, = ID.unpack_from(self._map, self._ids + ID.size * i)
+        lat, lon = COORD.unpack_from(self._map, self._coords + COORD.size * i)
+        return CityEntry(id, name, country, lat, lon)
+
+    def lookup(self, prefix, limit=20):
+        """Return up to limit CityEntry candidates starting with prefix.
+
+        Exact matches come first, then shorter names, in name order.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        # no utf-8 byte sorts after '\xff', so this bounds the prefix range
+        start = bisect.bisect_left(self._keys, prefix)
+        end = bisect.bisect_left(self._keys, prefix + '\xff', start)
+
+        # every key of the range starts with the prefix, so the exact
+        # matches are the shortest, and the whole range is ranked from
+        # the lengths column without reading the keys
+        lengths = struct.unpack_from('<%dH' % (end - start), self._map,
+                                     self._lengths + LENGTH.size * start)
+        best = heapq.nsmallest(limit, xrange(end - start),
+                               key=lengths.__getitem__)
+        return [self.get_entry(start + i) for i in best]
+
+def load(path):
+    """Return the CityIndex at path, or None if there is none."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return CityIndex(path)
+    except (IOError, ValueError, struct.error) as error:
+        _logger.debug('could not load city index: %s' % (error))
+        return None
+
+def read_city_list(path):
+    """Yield the cities of an OpenWeatherMap city list.
+
+    Both the JSON array and the older one object per line formats are
+    accepted.
+    """
+    data = open(path, 'r')
+    try:
+        text = data.read()
+    finally:
+        data.close()
+
+    try:
+        cities = json.loads(text)
+    except ValueError:
+        cities = [json.loads(line) for line in text.splitlines()
+                  if line.strip()]
+
+    for city in cities:
+        yield (city['id'], city['name'], city.get('country', ''),
+               city['coord']['lat'], city['coord']['lon'])
+
+def build(cities, path):
+    """Write an index of (id, name, country, lat, lon) tuples to path."""
+    entries = []
+    for id, name, country, lat, lon in cities:
+        key = normalize(name)
+        if not key:
+            continue
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        if isinstance(country, unicode):
+            country = country.encode('utf-8')
+        entries.append((key, name, country, id, lat, lon))
+    entries.sort()
+
+    ids = []
+    coords = []
+    lengths = []
+    offsets = [OFFSET.pack(0)]
+    blob = []
+    size = 0
+    for key, name, country, id, lat, lon in entries:
+        strings = '\0'.join((key, name.replace('\0', ''),
+                             country.replace('\0', '')))
+        blob.append(strings)
+        size += len(strings)
+        ids.append(ID.pack(id))
+        coords.append(COORD.pack(lat, lon))
+        lengths.append(LENGTH.pack(min(len(key), 0xffff)))
+        offsets.append(OFFSET.pack(size))
+
+    temp_path = path + '.part'
+    index = open(temp_path, 'wb')
+    try:
+        index.write(HEADER.pack(MAGIC, len(entries)))
+        index.write(''.join(ids))
+        index.write(''.join(coords))
+        index.write(''.join(lengths))
+        index.write(''.join(offsets))
+        index.write(''.join(blob))
+    finally:
+        index.close()
+    os.rename(temp_path, path)
+
+    return len(entries)
+
+def main(argv):
+    if len(argv) != 3:
+        sys.stderr.write('usage: %s city.list.json %s\n' % (argv[0],
+                                                            INDEX_FILE))
+        return 1
+    count = build(read_city_list(argv[1]), argv[2])
+    sys.stdout.write('%d cities written to %s\n' % (count, argv[2]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
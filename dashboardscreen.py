@@ -0,0 +1,87 @@
+# dashboardscreen.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+from gi.repository import Gtk
+
+import logging
+import searchscreen
+import openweathermap
+
+from gettext import gettext as _
+
+_logger = logging.getLogger('weather-activity')
+
+howto = _('Select a city and press the star to add it to your favorites.')
+
+class DashboardScreen(Gtk.Box):
+    def __init__(self, activity):
+        Gtk.Box.__init__(self)
+
+        self.activity = activity
+        self.cities = {}
+
+        self.howto_label = Gtk.Label(howto)
+
+        self.treeview = searchscreen.SearchTreeView(self.activity)
+
+        self.scroll = Gtk.ScrolledWindow()
+        self.scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        self.scroll.add(self.treeview)
+        self.scroll.show()
+
+        self.set_orientation(Gtk.Orientation.VERTICAL)
+        self.pack_start(self.howto_label, expand=True, fill=False, padding=0)
+        self.pack_start(self.scroll, expand=True, fill=True, padding=0)
+
+        self.show()
+
+    def refresh(self, use_cache=False):
+        """Fetch the weather of every favorite, a group request per chunk."""
+        ids = self.activity.favorites
+        self.cities = dict([(id, city) for id, city in self.cities.items()
+                            if id in ids])
+        self.display_results()
+
+        self.activity.requests.cancel_matching(screen=self)
+        for source in openweathermap.get_group_sources(ids):
+            self.activity.add_download(source, self, supersede=False,
+                                       use_cache=use_cache)
+
+    def parse(self, data):
+        # runs on the parse thread
+        return openweathermap.load_cities(data)
+
+    def download_complete(self, request, cities):
+        for city in cities:
+            self.cities[city.id] = city
+
+    def display_results(self):
+        results = [self.cities[id] for id in self.activity.favorites
+                   if id in self.cities]
+        self.treeview.update(results)
+
+        if self.activity.favorites:
+            self.howto_label.hide()
+        else:
+            self.howto_label.show()
+
+    def update_temperatures(self):
+        self.treeview.update_temperatures()
@@ -0,0 +1,65 @@
+# fastjson.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+# Decoding of API responses with the fastest JSON module installed.
+# ujson and simplejson are optional, the standard json module is used
+# when neither is there. Set WEATHER_JSON to one of BACKENDS to choose.
+
+import os
+import json
+import logging
+
+_logger = logging.getLogger('weather-activity')
+
+# in order of preference
+BACKENDS = ('ujson', 'simplejson', 'json')
+
+_backend = None
+
+def _load_backend(names):
+    for name in names:
+        try:
+            module = __import__(name)
+        except ImportError:
+            continue
+        # simplejson without its C extension is slower than json
+        if name == 'simplejson':
+            try:
+                __import__('simplejson._speedups')
+            except ImportError:
+                continue
+        return name, module.loads
+    return 'json', json.loads
+
+def get_backend():
+    """Return the name and loads function of the JSON module in use."""
+    global _backend
+    if _backend is None:
+        names = BACKENDS
+        if os.environ.get('WEATHER_JSON') in BACKENDS:
+            names = (os.environ['WEATHER_JSON'],)
+        _backend = _load_backend(names)
+        _logger.debug('decoding JSON with %s' % (_backend[0]))
+    return _backend
+
+def loads(text):
+    """Decode a response, raising ValueError if it is not valid JSON."""
+    return get_backend()[1](text)
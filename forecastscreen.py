@@ -23,14 +23,17 @@ from gi.repository import Gtk
 from gi.repository import Gdk
 from gi.repository import GdkPixbuf
 
-import os
+import timing
 import logging
+import profiling
+import iconcache
+import viewmodel
+import openweathermap
 
 from datetime import datetime
 from gettext import gettext as _
 
 from sugar3.graphics import style
-from sugar3.graphics.icon import Icon
 
 SCREEN_WIDTH = Gdk.Screen.width()
 SCREEN_HEIGHT = Gdk.Screen.height()
@@ -39,11 +42,10 @@ GREY = style.COLOR_PANEL_GREY.get_html()
 
 _logger = logging.getLogger('weather-activity')
 
-calendar = [_('Jan'), _('Feb'), _('Mar'), _('Apr'), _('May'), _('Jun'),
-            _('Jul'), _('Aug'), _('Sep'), _('Oct'), _('Nov'), _('Dec')]
+DAILY_PAGE, HOURLY_PAGE = range(2)
 
-week = [_('Monday'), _('Tuesday'), _('Wednesday'), _('Thursday'),
-        _('Friday'), _('Saturday'), _('Sunday')]
+(FORECAST_COLUMN, DATE_COLUMN, ICON_COLUMN, INFO_COLUMN, WIND_COLUMN,
+ CLOUDS_COLUMN, PRESSURE_COLUMN, HUMIDITY_COLUMN) = range(8)
 
 class ForecastDailyTreeView(Gtk.TreeView):
     def __init__(self, activity):
@@ -51,7 +53,8 @@ class ForecastDailyTreeView(Gtk.TreeView):
         
         self.activity = activity
         
-        self.liststore = Gtk.ListStore(object)
+        self.liststore = Gtk.ListStore(object, str, GdkPixbuf.Pixbuf, str,
+                                       str, str, str, str)
         
         self.set_grid_lines(Gtk.TreeViewGridLines.HORIZONTAL)
         
@@ -60,113 +63,180 @@ class ForecastDailyTreeView(Gtk.TreeView):
         
         renderer_pixbuf = Gtk.CellRendererPixbuf()
         
-        column = Gtk.TreeViewColumn(_('Next days'), renderer_text)
-        column.set_cell_data_func(renderer_text, self.load_date)
+        column = Gtk.TreeViewColumn(_('Next days'), renderer_text, 
+                                    text=DATE_COLUMN)
         column.set_min_width(SCREEN_WIDTH / 7)
         column.set_max_width(SCREEN_WIDTH / 7)
         self.append_column(column)
         
-        column = Gtk.TreeViewColumn('', renderer_pixbuf)
-        column.set_cell_data_func(renderer_pixbuf, self.load_pixbuf)
+        column = Gtk.TreeViewColumn('', renderer_pixbuf, pixbuf=ICON_COLUMN)
         column.set_min_width(SCREEN_WIDTH / 9)
         column.set_max_width(SCREEN_WIDTH / 9)
         self.append_column(column)
         
-        column = Gtk.TreeViewColumn('', renderer_text)
-        column.set_cell_data_func(renderer_text, self.load_info)
+        column = Gtk.TreeViewColumn('', renderer_text, markup=INFO_COLUMN)
         column.set_min_width(SCREEN_WIDTH / 4)
         column.set_max_width(SCREEN_WIDTH / 4)
         self.append_column(column)
         
-        column = Gtk.TreeViewColumn(_('Wind'), renderer_text)
-        column.set_cell_data_func(renderer_text, self.load_wind)
+        column = Gtk.TreeViewColumn(_('Wind'), renderer_text, 
+                                    text=WIND_COLUMN)
         column.set_min_width(SCREEN_WIDTH / 9)
         column.set_max_width(SCREEN_WIDTH / 9)
         self.append_column(column)
         
-        column = Gtk.TreeViewColumn(_('Clouds'), renderer_text)
-        column.set_cell_data_func(renderer_text, self.load_clouds)
+        column = Gtk.TreeViewColumn(_('Clouds'), renderer_text, 
+                                    text=CLOUDS_COLUMN)
         column.set_min_width(SCREEN_WIDTH / 10)
         column.set_max_width(SCREEN_WIDTH / 10)
         self.append_column(column)
         
-        column = Gtk.TreeViewColumn(_('Pressure'), renderer_text)
-        column.set_cell_data_func(renderer_text, self.load_pressure)
+        column = Gtk.TreeViewColumn(_('Pressure'), renderer_text, 
+                                    text=PRESSURE_COLUMN)
         column.set_min_width(SCREEN_WIDTH / 8)
         column.set_max_width(SCREEN_WIDTH / 8)
         self.append_column(column)
         
-        column = Gtk.TreeViewColumn(_('Humidity'), renderer_text)
-        column.set_cell_data_func(renderer_text, self.load_humidity)
+        column = Gtk.TreeViewColumn(_('Humidity'), renderer_text, 
+                                    text=HUMIDITY_COLUMN)
         self.append_column(column)
         
         self.show()
+    
+    def update(self, city):
+        with timing.span('ForecastDailyTreeView.update',
+                         rows=len(city.forecast_daily)):
+            self.set_model(None)
+            self.liststore.clear()
+            
+            for forecast in city.forecast_daily:
+                self.liststore.append(viewmodel.forecast_row(self.activity,
+                                                             forecast))
+            
+            self.set_model(self.liststore)
+    
+    def update_temperatures(self):
+        for row in self.liststore:
+            row[INFO_COLUMN] = viewmodel.forecast_info(self.activity,
+                                                       row[FORECAST_COLUMN])
+
+class ForecastHourlyTreeView(Gtk.TreeView):
+    """Tree view of the 3 hour forecast steps.
+
+    The view runs in fixed height mode and formats a row only when it is
+    painted, so only the visible steps of the forecast are formatted.
+    """
+
+    def __init__(self, activity):
+        Gtk.TreeView.__init__(self)
+        
+        self.activity = activity
+        self.city = None
+        self.series = None
+        self._strings = {}
+        
+        self.liststore = Gtk.ListStore(int)
+        
+        self.set_grid_lines(Gtk.TreeViewGridLines.HORIZONTAL)
+        self.set_fixed_height_mode(True)
+        
+        renderer_text = Gtk.CellRendererText()
+        renderer_text.set_property('height', SCREEN_HEIGHT / 10)
+        
+        renderer_pixbuf = Gtk.CellRendererPixbuf()
+        
+        self.append_fixed_column(_('Next hours'), renderer_text,
+                                 ('text', 'time'), SCREEN_WIDTH / 7)
+        
+        column = Gtk.TreeViewColumn('', renderer_pixbuf)
+        column.set_cell_data_func(renderer_pixbuf, self.load_pixbuf)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        column.set_fixed_width(SCREEN_WIDTH / 9)
+        self.append_column(column)
+        
+        self.append_fixed_column('', renderer_text, ('markup', 'info'),
+                                 SCREEN_WIDTH / 4)
+        self.append_fixed_column(_('Wind'), renderer_text, ('text', 'wind'),
+                                 SCREEN_WIDTH / 9)
+        self.append_fixed_column(_('Clouds'), renderer_text,
+                                 ('text', 'clouds'), SCREEN_WIDTH / 10)
+        self.append_fixed_column(_('Pressure'), renderer_text,
+                                 ('text', 'pressure'), SCREEN_WIDTH / 8)
+        self.append_fixed_column(_('Humidity'), renderer_text,
+                                 ('text', 'humidity'), SCREEN_WIDTH / 9)
         
-    def load_date(self, column, cell_renderer, model, iter, data):
-        forecast = model.get_value(iter, 0)
-        timestamp = datetime.fromtimestamp(forecast['date'])
-        date = '        %s %d' %(calendar[timestamp.month - 1], timestamp.day)
-        cell_renderer.set_property('text', date)
+        self.show()
+    
+    def append_fixed_column(self, title, renderer, data, width):
+        column = Gtk.TreeViewColumn(title, renderer)
+        column.set_cell_data_func(renderer, self.load_text, data)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        column.set_fixed_width(width)
+        self.append_column(column)
+    
+    def get_strings(self, index):
+        strings = self._strings.get(index)
+        if strings is None:
+            strings = viewmodel.hourly_strings(self.activity,
+                                               self.series[index])
+            self._strings[index] = strings
+        return strings
+    
+    @profiling.profiled
+    def load_text(self, column, cell_renderer, model, iter, data):
+        name, key = data
+        strings = self.get_strings(model.get_value(iter, 0))
+        cell_renderer.set_property(name, strings[key])
     
+    @profiling.profiled
     def load_pixbuf(self, column, cell_renderer, model, iter, data):
-        cell_renderer.set_property('pixbuf', None)
-        forecast = model.get_value(iter, 0)
-        file_name = 'icons/%s.svg' % (forecast['icon'][:3])
-        icon = GdkPixbuf.Pixbuf.new_from_file(file_name)
-        cell_renderer.set_property('pixbuf', icon)
+        index = model.get_value(iter, 0)
+        pixbuf = iconcache.get_pixbuf(self.series.icons[index])
+        cell_renderer.set_property('pixbuf', pixbuf)
     
-    def load_info(self, column, cell_renderer, model, iter, data):
-        forecast = model.get_value(iter, 0)
-        temp_day = self.activity.convert(forecast['temp_day'])
-        temp_night = self.activity.convert(forecast['temp_night'])
-            
-        info = '<span foreground="black" background="#FFE578" \
-            > %s%s </span>  <span foreground="white" background="#4264BA" \
-            > %s%s </span>\n%s' % (temp_day, self.activity.temp_scale, 
-            temp_night, self.activity.temp_scale, forecast['weather'])
-            
-        cell_renderer.set_property('markup', info)
+    def show_city(self, city):
+        """Show the hourly forecast of a city, downloading it if needed."""
+        # the download of the city shown before is not wanted any more
+        self.activity.requests.cancel_matching(screen=self)
+        self.city = city
+        if len(city.forecast_hourly):
+            self.display_results()
+        else:
+            self.update(None)
+            self.download(city)
     
-    def load_wind(self, column, cell_renderer, model, iter, data):
-        cell_renderer.set_property('text', '')
-        forecast = model.get_value(iter, 0)
-        if forecast['wind_speed'] != None:
-            clouds = '\n%s %s' % (forecast['wind_speed'],
-                                  self.activity.wind_scale)
-            cell_renderer.set_property('text', clouds)
+    def download(self, city, use_cache=True):
+        source = openweathermap.get_hourly_source(city.id)
+        self.activity.add_download(source, self, use_cache=use_cache,
+                                   city=city)
     
-    def load_clouds(self, column, cell_renderer, model, iter, data):
-        cell_renderer.set_property('text', '')
-        forecast = model.get_value(iter, 0)
-        if forecast['clouds'] != None:
-            clouds = '\n    %s %s' % (int(forecast['clouds']),
-                                      self.activity.cloud_scale)
-            cell_renderer.set_property('text', clouds)
+    def parse(self, data):
+        # runs on the parse thread
+        return openweathermap.load_forecast_hourly(data['list'])
     
-    def load_pressure(self, column, cell_renderer, model, iter, data):
-        cell_renderer.set_property('text', '')
-        forecast = model.get_value(iter, 0)
-        if forecast['pressure'] != None:
-            pressure = '\n%s %s' % (forecast['pressure'],
-                                    self.activity.pressure_scale)
-            cell_renderer.set_property('text', pressure)
+    def download_complete(self, request, series):
+        request.data['city'].forecast_hourly = series
     
-    def load_humidity(self, column, cell_renderer, model, iter, data):
-        cell_renderer.set_property('text', '')
-        forecast = model.get_value(iter, 0)
-        if forecast['humidity'] != None:
-            humidity = '\n    %s %s' % (int(forecast['humidity']),
-                                        self.activity.humidity_scale)
-            cell_renderer.set_property('text', humidity)
+    def display_results(self):
+        self.update(self.city.forecast_hourly)
     
-    def update(self, city):
-        self.set_model(None)
-        self.liststore.clear()
-        
-        for forecast in city.forecast_daily:
-            self.liststore.append([forecast])
+    def update(self, series):
+        with timing.span('ForecastHourlyTreeView.update'):
+            self.set_model(None)
+            self.liststore.clear()
+            self.series = series
+            self._strings = {}
+            
+            if series is not None:
+                for index in range(len(series)):
+                    self.liststore.append([index])
             
-        self.set_model(self.liststore)
+            self.set_model(self.liststore)
+    
+    def update_temperatures(self):
+        # rows are formatted again as they are painted
+        self._strings = {}
+        self.queue_draw()
 
 class ForecastScreen(Gtk.Box):
     def __init__(self, activity):
@@ -178,8 +248,7 @@ class ForecastScreen(Gtk.Box):
         self.name_label.set_alignment(0, 0)
         self.name_label.show()
         
-        self.icon = Icon(pixel_size=SCREEN_HEIGHT / 4, 
-                        fill_color=style.COLOR_TOOLBAR_GREY.get_svg())
+        self.icon = Gtk.Image()
         self.icon.show()
         
         self.temp_label = Gtk.Label()
@@ -214,30 +283,61 @@ class ForecastScreen(Gtk.Box):
         self.scroll = Gtk.ScrolledWindow()
         self.scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
         self.scroll.add(self.forecast_daily_treeview)
-        self.scroll.set_size_request(-1, SCREEN_HEIGHT / 2.2)
         self.scroll.show()
         
+        self.forecast_hourly_treeview = ForecastHourlyTreeView(self.activity)
+        
+        hourly_scroll = Gtk.ScrolledWindow()
+        hourly_scroll.set_policy(Gtk.PolicyType.NEVER, 
+                                 Gtk.PolicyType.AUTOMATIC)
+        hourly_scroll.add(self.forecast_hourly_treeview)
+        hourly_scroll.show()
+        
+        self.notebook = Gtk.Notebook()
+        self.notebook.append_page(self.scroll, Gtk.Label(_('Daily')))
+        self.notebook.append_page(hourly_scroll, Gtk.Label(_('Hourly')))
+        self.notebook.set_size_request(-1, SCREEN_HEIGHT / 2.2)
+        self.notebook.connect('switch-page', self.notebook_switch_page_cb)
+        self.notebook.show()
+        
         self.set_orientation(Gtk.Orientation.VERTICAL)
         self.pack_start(grid, expand=True, fill=False, padding=0)
-        self.pack_start(self.scroll, expand=False, fill=False, padding=0)
+        self.pack_start(self.notebook, expand=False, fill=False, padding=0)
         
         self.show()
     
-    def get_daily_forecast(self):
+    @profiling.profiled
+    def notebook_switch_page_cb(self, notebook, page, page_num):
         city = self.activity.selected_city
-        source = 'forecast/daily?id=%s&mode=json&cnt=7' % (city.id)
-        dest = os.path.join(self.activity.get_activity_root(), 'tmp', 
-                            '', str(city.id) + '.json')
-        self.activity.add_download(source, dest)
+        if page_num == HOURLY_PAGE and city is not None:
+            self.forecast_hourly_treeview.show_city(city)
+    
+    def get_daily_forecast(self, use_cache=True):
+        city = self.activity.selected_city
+        source = openweathermap.get_daily_source(city.id)
+        if use_cache:
+            self.activity.prefetcher.claim(source)
+        self.activity.add_download(source, self, use_cache=use_cache,
+                                   city=city)
 
-    def download_complete(self, downloader, file_path, file_name):
-        forecast = self.activity.read_file(file_path)['list']
-        self.activity.selected_city.load_forecast_daily(forecast)
-        self.activity.set_canvas(self)
+    def parse(self, data):
+        # runs on the parse thread
+        return openweathermap.load_forecast_daily(data['list'])
+    
+    def download_complete(self, request, series):
+        city = request.data['city']
+        city.forecast_daily = series
+        # another row may have been selected since the request was made
+        if city is self.activity.selected_city:
+            self.activity.set_canvas(self)
     
     def refresh(self):
         self.activity.search_entry.set_text(self.activity.input)
-        self.get_daily_forecast()
+        self.get_daily_forecast(use_cache=False)
+        # the hourly forecast is otherwise only fetched while it is empty
+        city = self.activity.selected_city
+        if self.notebook.get_current_page() == HOURLY_PAGE:
+            self.forecast_hourly_treeview.download(city, use_cache=False)
     
     def update_current(self, city):
         font_size = 28
@@ -252,13 +352,11 @@ class ForecastScreen(Gtk.Box):
         timestamp = datetime.fromtimestamp(city.date)
         day = timestamp.weekday()
         time = '%02d:%02d' % (timestamp.hour, timestamp.minute)
-        desc = '<span font="Sans 16">%s %s\n%s</span>' % (week[day], time,
-                                                          city.weather)
+        desc = '<span font="Sans 16">%s %s\n%s</span>' % (
+            viewmodel.week[day], time, city.weather)
             
-        file_name = 'icons/%s.svg' % (city.icon[:3])
-        self.icon.hide()
-        self.icon.set_file(file_name)
-        self.icon.show()
+        pixbuf = iconcache.get_pixbuf(city.icon, SCREEN_HEIGHT / 4)
+        self.icon.set_from_pixbuf(pixbuf)
             
         temp = self.activity.convert(city.temp)
         degree = '<span stretch="ultracondensed" font="Sans 40"> %s</span>'\
@@ -299,5 +397,19 @@ class ForecastScreen(Gtk.Box):
         if city:
             self.update_current(city)
             self.forecast_daily_treeview.update(city)
+            if self.notebook.get_current_page() == HOURLY_PAGE:
+                hourly = self.forecast_hourly_treeview
+                if hourly.city is not city:
+                    hourly.show_city(city)
+                elif hourly.series is not city.forecast_hourly:
+                    # fetched again by a refresh
+                    hourly.display_results()
+    
+    def update_temperatures(self):
+        city = self.activity.selected_city
+        if city:
+            self.update_current(city)
+            self.forecast_daily_treeview.update_temperatures()
+            self.forecast_hourly_treeview.update_temperatures()
 
     
\ No newline at end of file
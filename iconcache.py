@@ -0,0 +1,81 @@
+# iconcache.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+from gi.repository import GdkPixbuf
+
+import logging
+
+from collections import OrderedDict
+
+_logger = logging.getLogger('weather-activity')
+
+# native size of the svg files in icons/
+ICON_SIZE = 75
+
+# 18 weather codes at a handful of sizes
+MAX_SIZE = 64
+
+class IconCache(object):
+    """Bounded LRU cache of weather icons rasterized once per pixel size."""
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._pixbufs = OrderedDict()
+
+    def get(self, icon, size=ICON_SIZE):
+        """Return the pixbuf for an OpenWeatherMap icon code, e.g. '01d'."""
+        key = (icon[:3], int(size))
+
+        pixbuf = self._pixbufs.pop(key, None)
+        if pixbuf is None:
+            self.misses += 1
+            file_name = 'icons/%s.svg' % (key[0])
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(file_name,
+                                                            key[1], key[1])
+            if len(self._pixbufs) >= self.max_size:
+                self._pixbufs.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+
+        self._pixbufs[key] = pixbuf
+        return pixbuf
+
+    def clear(self):
+        self._pixbufs.clear()
+
+    def log_stats(self):
+        _logger.debug('icon cache: %d entries, %d hits, %d misses, '
+                      '%d evictions' % (len(self._pixbufs), self.hits,
+                                        self.misses, self.evictions))
+
+_cache = IconCache()
+
+def get_pixbuf(icon, size=ICON_SIZE):
+    """Return a shared, cached pixbuf for an icon code."""
+    return _cache.get(icon, size)
+
+def get_cache():
+    return _cache
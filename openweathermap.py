@@ -19,118 +19,344 @@
 # to the Free Software Foundation, Inc., 51 Franklin
 # St, Fifth Floor, Boston, MA 02110-1301  USA
 
+import temperature
+
+from array import array
 from gettext import gettext as _
 
+# most city ids accepted by one call to the group endpoint
+GROUP_LIMIT = 20
+
+EMPTY = {}
+
 class City(object):
+    __slots__ = ('clouds', 'name', 'url', 'country', 'icon', 'weather_code',
+                 'weather', 'date', 'pressure', 'temp', 'temp_max',
+                 'temp_min', 'id', 'humidity', 'wind_speed', 'lon', 'lat',
+                 '_forecast_daily', '_forecast_hourly')
+
     def __init__(self, info):
+        # only the fields used are read, and only the strings need to be
+        # encoded, which is most of the cost of building a city
+        main = info['main']
+        weather = info['weather'][0]
+        # box/city results have no sys and may lack clouds or wind
+        coord = info.get('coord', EMPTY)
+        
+        self.clouds = info.get('clouds', EMPTY).get('all')
+        self.name = encode(info.get('name'))
+        self.url = encode(info.get('url'))
+        self.country = encode(info.get('sys', EMPTY).get('country'))
+        self.icon = encode(weather.get('icon'))
+        self.weather_code = weather.get('id')
+        self.weather = get_condition(self.weather_code,
+                                     encode(weather.get('description', '')))
+        self.date = info.get('dt')
+        self.pressure = main.get('pressure')
+        self.temp = main.get('temp')
+        self.temp_max = main.get('temp_max')
+        self.temp_min = main.get('temp_min')
+        self.id = info.get('id')
+        self.humidity = main.get('humidity')
+        self.wind_speed = info.get('wind', EMPTY).get('speed')
+        self.lon = coord.get('lon', coord.get('Lon'))
+        self.lat = coord.get('lat', coord.get('Lat'))
         
-        self.clouds = get_value(info['clouds'], 'all')
-        self.name = get_value(info, 'name')
-        self.url = get_value(info, 'url')
-        self.country = get_value(info['sys'], 'country')
-        self.icon = get_value(info['weather'][0], 'icon')
-        self.weather_code = get_value(info['weather'][0], 'id')
-        self.weather = condition_codes[self.weather_code]
-        self.date = get_value(info, 'dt')
-        self.pressure = get_value(info['main'], 'pressure')
-        self.temp = get_value(info['main'], 'temp')
-        self.temp_max = get_value(info['main'], 'temp_max')
-        self.temp_min = get_value(info['main'], 'temp_min')
-        self.id = get_value(info, 'id')
-        self.humidity = get_value(info['main'], 'humidity')
-        self.wind_speed = get_value(info['wind'], 'speed')
+        # most cities of a search are never opened, their empty forecasts
+        # are made on first use
+        self._forecast_daily = None
+        self._forecast_hourly = None
+    
+    @property
+    def forecast_daily(self):
+        if self._forecast_daily is None:
+            self._forecast_daily = ForecastSeries(DAILY_FIELDS)
+        return self._forecast_daily
+    
+    @forecast_daily.setter
+    def forecast_daily(self, series):
+        self._forecast_daily = series
+    
+    @property
+    def forecast_hourly(self):
+        if self._forecast_hourly is None:
+            self._forecast_hourly = ForecastSeries(HOURLY_FIELDS)
+        return self._forecast_hourly
+    
+    @forecast_hourly.setter
+    def forecast_hourly(self, series):
+        self._forecast_hourly = series
+    
+    def to_record(self, forecasts=True):
+        """Return the city, and its forecasts, as a compact JSON-able list."""
+        record = [getattr(self, field) for field in CITY_FIELDS]
+        if forecasts:
+            record.append(self.forecast_daily.to_record())
+            record.append(self.forecast_hourly.to_record())
+        return record
+    
+    @classmethod
+    def from_record(cls, record):
+        """Build a city back from the list returned by to_record."""
+        city = cls.__new__(cls)
+        for field, value in zip(CITY_FIELDS, record):
+            if type(value) == unicode:
+                value = value.encode('utf-8')
+            setattr(city, field, value)
+        city.weather = get_condition(city.weather_code)
+        city.lon = city.lat = None
         
-        self.forecast_daily = []
-        self.forecast_hourly = []
+        daily, hourly = (record[len(CITY_FIELDS):] + [None, None])[:2]
+        city.forecast_daily = ForecastSeries.from_record(DAILY_FIELDS, daily)
+        city.forecast_hourly = ForecastSeries.from_record(HOURLY_FIELDS,
+                                                          hourly)
+        return city
     
+    def update(self, city):
+        """Take the current weather of a newer copy of this city."""
+        for field in CITY_FIELDS:
+            setattr(self, field, getattr(city, field))
+        self.weather = city.weather
+
     def load_forecast_daily(self, dict):
-        self.forecast_daily = []
-        for key in dict:
-            self.forecast_daily.append({
-                'clouds' : get_value(key, 'clouds'),
-                'icon' : get_value(key['weather'][0], 'icon'),
-                'weather_code' : get_value(key['weather'][0], 'id'),
-                'weather' : condition_codes[get_value(key['weather'][0], 'id')],
-                'date' : get_value(key, 'dt'),
-                'temp_day' : get_value(key['temp'], 'day'),
-                'temp_night' : get_value(key['temp'], 'night'),
-                'wind_speed' : get_value(key, 'speed'),
-                'pressure' : get_value(key, 'pressure'),
-                'humidity' : get_value(key, 'humidity')})
+        self.forecast_daily = load_forecast_daily(dict)
 
     def load_forecast_hourly(self, dict):
-        self.forecast_hourly = []
-        for key in dict:
-            self.forecast_hourly.append({
-                'clouds' : get_value(key['clouds'], 'all'),
-                'icon' : get_value(key['weather'][0], 'icon'),
-                'weather_code' : get_value(key['weather'][0], 'id'),
-                'weather' : condition_codes[get_value(key['weather'][0], 'id')],
-                'date' : get_value(key, 'dt'),
-                'temp' : get_value(key['main'], 'temp'),
-                'temp_max' : get_value(key['main'], 'temp_max'),
-                'temp_min' : get_value(key['main'], 'temp_min'),
-                'wind_speed' : get_value(key['wind'], 'speed'),
-                'wind_deg' : get_value(key['wind'], 'deg'),
-                'pressure' : get_value(key['main'], 'pressure'),
-                'humidity' : get_value(key['main'], 'humidity')})
-
-def get_value(dict, key):
-        if key in dict:
-            value = dict[key]
-            if type(value) == unicode:
-                return value.encode('utf-8')
-            return value
-        else:
+        self.forecast_hourly = load_forecast_hourly(dict)
+
+# the City attributes kept by to_record, in order
+CITY_FIELDS = ('id', 'name', 'url', 'country', 'icon', 'weather_code', 'date',
+               'clouds', 'pressure', 'temp', 'temp_max', 'temp_min',
+               'humidity', 'wind_speed')
+
+DAILY_FIELDS = ('temp_day', 'temp_night', 'wind_speed', 'pressure',
+                'humidity', 'clouds')
+
+HOURLY_FIELDS = ('temp', 'temp_max', 'temp_min', 'wind_speed', 'wind_deg',
+                 'pressure', 'humidity', 'clouds')
+
+NAN = float('nan')
+
+class ForecastSeries(object):
+    """Forecast steps stored column by column in typed arrays.
+
+    The dates and weather codes are integer columns, the icons a list of
+    short strings and every other field a double column where a missing
+    value is NaN. Indexing or iterating yields ForecastRow views that
+    read like the dictionaries the tree views used to get.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.dates = array('l')
+        self.weather_codes = array('i')
+        self.icons = []
+        self.columns = dict([(field, array('d')) for field in fields])
+        self._columns = [self.columns[field] for field in fields]
+        self._converted = {}
+
+    def append(self, date, weather, values):
+        """Add a step from its dt, weather dict and field values in order."""
+        self._converted.clear()
+        self.dates.append(date)
+        self.weather_codes.append(weather['id'])
+        self.icons.append(str(weather['icon']))
+        for column, value in zip(self._columns, values):
+            if value is None:
+                value = NAN
+            column.append(value)
+
+    def to_record(self):
+        """Return the steps as lists, one per column, or None if empty."""
+        if not len(self.dates):
             return None
+        return [self.dates.tolist(), self.weather_codes.tolist(), self.icons,
+                [[value if value == value else None for value in column]
+                 for column in self._columns]]
+
+    @classmethod
+    def from_record(cls, fields, record):
+        series = cls(fields)
+        if record is None:
+            return series
+        dates, codes, icons, columns = record
+        series.dates.extend(dates)
+        series.weather_codes.extend(codes)
+        series.icons = [str(icon) for icon in icons]
+        for column, values in zip(series._columns, columns):
+            column.extend([NAN if value is None else value
+                           for value in values])
+        return series
+
+    def get(self, key, index):
+        if key == 'date':
+            return self.dates[index]
+        if key == 'icon':
+            return self.icons[index]
+        if key == 'weather_code':
+            return self.weather_codes[index]
+        if key == 'weather':
+            return get_condition(self.weather_codes[index])
+        value = self.columns[key][index]
+        if value != value:
+            return None
+        return value
+
+    def converted(self, key, scale):
+        """Return a temperature column converted to scale, as a list.
+
+        The whole column is converted at once and kept until the series
+        changes.
+        """
+        column = self._converted.get((key, scale))
+        if column is None:
+            column = temperature.convert_all(self.columns[key], scale)
+            self._converted[(key, scale)] = column
+        return column
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.dates)
+        if not 0 <= index < len(self.dates):
+            raise IndexError(index)
+        return ForecastRow(self, index)
+
+    def __iter__(self):
+        for index in xrange(len(self.dates)):
+            yield ForecastRow(self, index)
+
+class ForecastRow(object):
+    """View of one step of a ForecastSeries."""
+
+    __slots__ = ('series', 'index')
+
+    def __init__(self, series, index):
+        self.series = series
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.series.get(key, self.index)
+
+    def converted(self, key, scale):
+        return self.series.converted(key, scale)[self.index]
+
+def load_cities(data):
+    """Return the City objects of a find or group response."""
+    return [City(info) for info in data['list']]
+
+def load_forecast_daily(steps):
+    """Return the ForecastSeries of the steps of a forecast/daily response."""
+    series = ForecastSeries(DAILY_FIELDS)
+    for key in steps:
+        temp = key['temp']
+        series.append(
+            key['dt'], key['weather'][0],
+            (temp.get('day'), temp.get('night'), key.get('speed'),
+             key.get('pressure'), key.get('humidity'), key.get('clouds')))
+    return series
+
+def load_forecast_hourly(steps):
+    """Return the ForecastSeries of the steps of a forecast response."""
+    series = ForecastSeries(HOURLY_FIELDS)
+    for key in steps:
+        main = key['main']
+        wind = key['wind']
+        series.append(
+            key['dt'], key['weather'][0],
+            (main.get('temp'), main.get('temp_max'), main.get('temp_min'),
+             wind.get('speed'), wind.get('deg'), main.get('pressure'),
+             main.get('humidity'), key['clouds'].get('all')))
+    return series
+
+def get_daily_source(id):
+    return 'forecast/daily?id=%s&mode=json&cnt=7' % (id)
+
+def get_hourly_source(id):
+    return 'forecast?id=%s&mode=json' % (id)
+
+def get_box_source(west, south, east, north, zoom):
+    """Return the source of the cities in a box, at an API map zoom."""
+    return 'box/city?bbox=%.3f,%.3f,%.3f,%.3f,%d&cluster=yes' % (
+        west, south, east, north, zoom)
+
+def get_group_sources(ids):
+    """Return the group source strings that fetch the given city ids."""
+    sources = []
+    for i in range(0, len(ids), GROUP_LIMIT):
+        chunk = ','.join([str(id) for id in ids[i:i + GROUP_LIMIT]])
+        sources.append('group?id=%s&mode=json' % (chunk))
+    return sources
+
+def encode(value):
+    """Return a unicode string encoded in UTF-8, other values as they are."""
+    if type(value) == unicode:
+        return value.encode('utf-8')
+    return value
+
+_condition_codes = None
+
+def get_condition(code, default=''):
+    """Return the translated description of a weather condition code.
+
+    A code missing from the table, such as one added to the API later,
+    gives default.
+    """
+    global _condition_codes
+    if _condition_codes is None:
+        _condition_codes = load_condition_codes()
+    return _condition_codes.get(code, default)
 
-condition_codes = {
-    200 : _('thunderstorm with light rain'),
-    201 : _('thunderstorm with rain'),
-    202 : _('thunderstorm with heavy rain'),
-    210 : _('light thunderstorm'),
-    211 : _('thunderstorm'),
-    212 : _('heavy thunderstorm'),
-    221 : _('ragged thunderstorm'),
-    230 : _('thunderstorm with light drizzle'),
-    231 : _('thunderstorm with drizzle'),
-    232 : _('thunderstorm with heavy drizzle'),
-    300 : _('light intensity drizzle'),
-    301 : _('drizzle'),
-    302 : _('heavy intensity drizzle'),
-    310 : _('light intensity drizzle rain'),
-    311 : _('drizzle rain'),
-    312 : _('heavy intensity drizzle rain'),
-    321 : _('shower drizzle'),
-    500 : _('light rain'),
-    501 : _('moderate rain'),
-    502 : _('heavy intensity rain'),
-    503 : _('very heavy rain'),
-    504 : _('extreme rain'),
-    511 : _('freezing rain'),
-    520 : _('light intensity shower rain'),
-    521 : _('shower rain'),
-    522 : _('heavy intensity shower rain'),
-    600 : _('light snow'),
-    601 : _('snow'),
-    602 : _('heavy snow'),
-    611 : _('sleet'),
-    621 : _('shower snow'),
-    701 : _('mist'),
-    711 : _('smoke'),
-    721 : _('haze'),
-    731 : _('sand/dust whirls'),
-    741 : _('fog'),
-    761 : _('dust'),
-    800 : _('sky is clear'),
-    801 : _('few clouds'),
-    802 : _('scattered clouds'),
-    803 : _('broken clouds'),
-    804 : _('overcast clouds'),
-    900 : _('tornado'),
-    901 : _('tropical storm'),
-    902 : _('hurricane'),
-    903 : _('cold'),
-    904 : _('hot'),
-    905 : _('windy'),
-    906 : _('hail')}
\ No newline at end of file
+def load_condition_codes():
+    return {
+        200 : _('thunderstorm with light rain'),
+        201 : _('thunderstorm with rain'),
+        202 : _('thunderstorm with heavy rain'),
+        210 : _('light thunderstorm'),
+        211 : _('thunderstorm'),
+        212 : _('heavy thunderstorm'),
+        221 : _('ragged thunderstorm'),
+        230 : _('thunderstorm with light drizzle'),
+        231 : _('thunderstorm with drizzle'),
+        232 : _('thunderstorm with heavy drizzle'),
+        300 : _('light intensity drizzle'),
+        301 : _('drizzle'),
+        302 : _('heavy intensity drizzle'),
+        310 : _('light intensity drizzle rain'),
+        311 : _('drizzle rain'),
+        312 : _('heavy intensity drizzle rain'),
+        321 : _('shower drizzle'),
+        500 : _('light rain'),
+        501 : _('moderate rain'),
+        502 : _('heavy intensity rain'),
+        503 : _('very heavy rain'),
+        504 : _('extreme rain'),
+        511 : _('freezing rain'),
+        520 : _('light intensity shower rain'),
+        521 : _('shower rain'),
+        522 : _('heavy intensity shower rain'),
+        600 : _('light snow'),
+        601 : _('snow'),
+        602 : _('heavy snow'),
+        611 : _('sleet'),
+        621 : _('shower snow'),
+        701 : _('mist'),
+        711 : _('smoke'),
+        721 : _('haze'),
+        731 : _('sand/dust whirls'),
+        741 : _('fog'),
+        761 : _('dust'),
+        800 : _('sky is clear'),
+        801 : _('few clouds'),
+        802 : _('scattered clouds'),
+        803 : _('broken clouds'),
+        804 : _('overcast clouds'),
+        900 : _('tornado'),
+        901 : _('tropical storm'),
+        902 : _('hurricane'),
+        903 : _('cold'),
+        904 : _('hot'),
+        905 : _('windy'),
+        906 : _('hail')}
\ No newline at end of file
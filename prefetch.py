@@ -0,0 +1,129 @@
+# prefetch.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+import os
+import logging
+import fastjson
+import openweathermap
+import requestmanager
+
+_logger = logging.getLogger('weather-activity')
+
+# number of top search results whose daily forecast is fetched in the
+# background, 0 turns prefetching off
+PREFETCH_COUNT = int(os.environ.get('WEATHER_PREFETCH', '0'))
+
+class Prefetcher(object):
+    """Fetch the daily forecasts of the top search results at low priority.
+
+    The responses go into the activity's response cache, where the
+    forecast screen finds them when the user asks for one.
+    """
+
+    def __init__(self, activity, count=PREFETCH_COUNT):
+        self.activity = activity
+        self.count = count
+
+        self.requests = []
+        self.prefetched = set()
+        self.used = set()
+
+        self.fetched = 0
+        self.failed = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+
+    def start(self, cities):
+        """Prefetch the forecasts of the first cities of a result list.
+
+        The prefetches of the previous list are ended by stop() when its
+        search starts.
+        """
+        for city in cities[:self.count]:
+            source = openweathermap.get_daily_source(city.id)
+            if self.activity.response_cache.contains(source):
+                continue
+            request = self.activity.requests.add(
+                source, self._complete, self._error,
+                priority=requestmanager.PRIORITY_LOW, background=True,
+                parse=self._parse)
+            self.requests.append(request)
+
+    def stop(self):
+        """Cancel pending prefetches and count the unused ones as wasted."""
+        for request in self.requests:
+            self.activity.requests.cancel(request)
+        self.requests = []
+
+        self.wasted += len(self.prefetched - self.used)
+        self.prefetched = set()
+        self.used = set()
+        self.log_stats()
+
+    def claim(self, source):
+        """Record whether a forecast the user asked for was prefetched."""
+        if not self.count:
+            return
+        if source in self.prefetched:
+            self.used.add(source)
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def _parse(self, request, text):
+        # runs on the parse thread
+        try:
+            data = fastjson.loads(text)
+        except ValueError:
+            return False
+        if str(data.get('cod')) != '200':
+            return False
+
+        self.activity.response_cache.put(request.source, text)
+        return True
+
+    def _complete(self, request, stored):
+        self.requests.remove(request)
+        # a corrupt or refused response is not stored
+        if not stored:
+            self.failed += 1
+            return
+
+        self.prefetched.add(request.source)
+        self.fetched += 1
+
+    def _error(self, request, message):
+        self.requests.remove(request)
+        self.failed += 1
+        _logger.debug('prefetch of %s failed: %s' % (request.source, message))
+
+    def log_stats(self):
+        if not self.count:
+            return
+        asked = self.hits + self.misses
+        rate = 0.0
+        if asked:
+            rate = 100.0 * self.hits / asked
+        _logger.debug('prefetch of %d: %d fetched, %d failed, %d hits, '
+                      '%d misses (%.0f%%), %d wasted' % (
+                          self.count, self.fetched, self.failed, self.hits,
+                          self.misses, rate, self.wasted))
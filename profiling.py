@@ -0,0 +1,94 @@
+# profiling.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+# Call-level profiles of the activity callbacks. Set WEATHER_PROFILE=1
+# and the signal handlers, idle callbacks and cell data functions
+# decorated with profiled() run under cProfile. The profile of the
+# session is written when the activity exits to
+# data/profile-<time>-<pid>.prof in the activity root, to be read with
+#
+#     python -m pstats profile-<time>-<pid>.prof
+#
+# When it is not set, profiled() returns the function unchanged.
+
+import os
+import time
+import atexit
+import logging
+import functools
+import threading
+
+_logger = logging.getLogger('weather-activity')
+
+ENABLED = bool(os.environ.get('WEATHER_PROFILE'))
+
+_profile = None
+_depth = 0
+_main_thread = threading.current_thread()
+
+def get_profile():
+    global _profile
+    if _profile is None:
+        import cProfile
+        _profile = cProfile.Profile()
+    return _profile
+
+def profiled(func):
+    """Decorate a callback so that its calls are profiled, if enabled."""
+    if not ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _depth
+        # cProfile only follows the thread it was enabled on
+        if threading.current_thread() is not _main_thread:
+            return func(*args, **kwargs)
+
+        # callbacks run from inside other callbacks, keep one level on
+        _depth += 1
+        if _depth == 1:
+            get_profile().enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _depth -= 1
+            if _depth == 0:
+                get_profile().disable()
+    return wrapper
+
+def start(directory):
+    """Write the session profile to directory when the process exits."""
+    if ENABLED:
+        atexit.register(dump, directory)
+
+def dump(directory):
+    if _profile is None:
+        return None
+    path = os.path.join(directory, 'profile-%d-%d.prof' % (time.time(),
+                                                           os.getpid()))
+    try:
+        _profile.dump_stats(path)
+    except (IOError, OSError) as error:
+        _logger.debug('profile not written: %s' % (error))
+        return None
+    _logger.debug('profile written to %s' % (path))
+    return path
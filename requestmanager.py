@@ -0,0 +1,521 @@
+# requestmanager.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+from gi.repository import GLib
+from gi.repository import GObject
+
+import os
+import time
+import Queue
+import timing
+import socket
+import responsecache
+import urllib
+import httplib
+import logging
+import itertools
+import threading
+
+from urlparse import urlparse
+
+_logger = logging.getLogger('weather-activity')
+
+# set WEATHER_API_URL to point the activity at another server, such as
+# benchmarks/mockserver.py
+API_URL = os.environ.get('WEATHER_API_URL',
+                         'http://api.openweathermap.org/data/2.5/')
+APPID = os.environ.get('WEATHER_APPID', '43ae262450afb936759b9e905323c7e5')
+
+# requests running at the same time, one keep-alive connection each
+MAX_CONNECTIONS = 2
+
+CHUNK_SIZE = 64 * 1024
+
+# seconds between two progress updates of a request
+PROGRESS_INTERVAL = 0.25
+
+TIMEOUT = 30
+
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 10
+
+# network calls per minute shared by every feature, to stay within the
+# quota of the APPID; set WEATHER_RATE_LIMIT=0 to turn the limit off
+RATE_LIMIT = int(os.environ.get('WEATHER_RATE_LIMIT', '60'))
+
+# calls that can be made at once after a quiet spell
+BURST = 10
+
+# calls of the budget that background requests leave to the user
+BACKGROUND_RESERVE = 3
+
+class RequestError(Exception):
+    pass
+
+def format_cpu(request):
+    """Return the CPU time spent on a request by the threads doing it."""
+    if request.fetch_cpu is None:
+        return 'cpu unknown'
+    text = '%.3fs fetch cpu' % (request.fetch_cpu)
+    if request.parse_cpu is not None:
+        text += ', %.3fs parse cpu' % (request.parse_cpu)
+    return text
+
+class TokenBucket(object):
+    """Budget of calls refilled at a steady rate, taken from any thread."""
+
+    def __init__(self, rate, capacity):
+        # tokens per second
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._time = time.time()
+        self._lock = threading.Lock()
+
+    def take(self, reserve=0):
+        """Take a token and return 0, or return the seconds to wait for one.
+
+        The last reserve tokens are not given out.
+        """
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self._time) * self.rate)
+            self._time = now
+            if self.tokens >= reserve + 1:
+                self.tokens -= 1
+                return 0
+            return (reserve + 1 - self.tokens) / self.rate
+
+class Request(object):
+    """State of one API request, from queueing to completion.
+
+    Extra keyword arguments given to RequestManager.add are kept in
+    the data dictionary for the callbacks.
+    """
+
+    def __init__(self, id, source, callback, error_callback, priority,
+                 background, parse, data):
+        self.id = id
+        self.source = source
+        self.callback = callback
+        self.error_callback = error_callback
+        self.priority = priority
+        self.background = background
+        self.parse = parse
+        self.data = data
+
+        self.received = 0
+        self.total = 0
+        self.cancelled = False
+        self.start_time = None
+        # CPU seconds of the worker and of the parse thread, when known
+        self.fetch_cpu = None
+        self.parse_cpu = None
+        self.throttled = False
+
+        # the request whose download this one shares, and the requests
+        # sharing this one's
+        self.primary = None
+        self.followers = []
+
+    def is_background(self):
+        """Return whether no foreground request shares this one."""
+        for follower in self.followers:
+            if not follower.background:
+                return False
+        return self.background
+
+    def is_wanted(self):
+        """Return whether this request or one sharing it is not cancelled."""
+        if not self.cancelled:
+            return True
+        for follower in self.followers:
+            if not follower.cancelled:
+                return True
+        return False
+
+    def get_path(self, base_path):
+        path = '%s%s&APPID=%s' % (base_path, self.source, APPID)
+        return urllib.quote(path, safe='/?&=,.-_')
+
+class RequestManager(GObject.GObject):
+    """Run API requests on a few worker threads.
+
+    Each worker keeps its own HTTP connection alive between requests, so
+    the number of workers caps the concurrency. A request with a parse
+    function has its body handed to a separate parse thread, which calls
+    parse(request, text) and passes the result on instead of the text;
+    a bad body makes parse raise RequestError, ValueError or a lookup
+    error. Callbacks run on the main loop: callback(request, result) or
+    error_callback(request, message), and never for a request cancelled
+    before they run. The 'progress' signal is emitted when the progress
+    of a foreground request changes.
+
+    A request for a source already being downloaded shares that
+    download. When it also has the same parse function and data, it
+    shares the parsed result too. The coalesced counter tells how many
+    network calls this saved.
+
+    Network calls are taken from a budget of rate_limit per minute. A
+    request that finds it spent goes back in the queue once a call may
+    be available, without holding a worker, and background requests
+    leave a few calls of it for the user.
+    """
+
+    __gsignals__ = {
+        'progress': (GObject.SignalFlags.RUN_FIRST, None, []),
+    }
+
+    def __init__(self, api_url=API_URL, max_connections=MAX_CONNECTIONS,
+                 rate_limit=RATE_LIMIT):
+        GObject.GObject.__init__(self)
+
+        url = urlparse(api_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.base_path = url.path
+
+        self.max_connections = max_connections
+        self.requests = {}
+
+        self.budget = None
+        if rate_limit:
+            self.budget = TokenBucket(rate_limit / 60.0, BURST)
+
+        self.fetched = 0
+        self.coalesced = 0
+        self.throttled = 0
+
+        # requests being downloaded by normalized source, shared with the
+        # workers under the lock
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+        self._queue = Queue.PriorityQueue()
+        self._parse_queue = Queue.PriorityQueue()
+        self._ids = itertools.count(1)
+        self._workers = []
+        self._parser = None
+
+    def add(self, source, callback, error_callback=None,
+            priority=PRIORITY_HIGH, background=False, parse=None, text=None,
+            **data):
+        """Queue a request for an API source string and return it.
+
+        When the text of the response is already known, from a cache for
+        example, it is only parsed.
+        """
+        request = Request(self._ids.next(), source, callback, error_callback,
+                          priority, background, parse, data)
+        self.requests[request.id] = request
+
+        if parse is not None and self._parser is None:
+            self._parser = threading.Thread(target=self._parse_work)
+            self._parser.daemon = True
+            self._parser.start()
+
+        if text is not None:
+            request.received = request.total = len(text)
+            self._deliver([request], text)
+            return request
+
+        key = responsecache.normalize(source)
+        with self._lock:
+            primary = self._in_flight.get(key)
+            if primary is not None:
+                request.primary = primary
+                primary.followers.append(request)
+            else:
+                self._in_flight[key] = request
+
+        if primary is not None:
+            self.coalesced += 1
+            _logger.debug('request %d %s joins request %d (%d network calls '
+                          'saved)' % (request.id, source, primary.id,
+                                      self.coalesced))
+            # a waiting download is moved up for a more urgent request
+            if priority < primary.priority:
+                primary.priority = priority
+                self._queue.put((priority, primary.id, primary))
+            return request
+
+        if len(self._workers) < self.max_connections:
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+        self._queue.put((priority, request.id, request))
+        return request
+
+    def cancel(self, request):
+        """Drop a request, none of its callbacks will run."""
+        request.cancelled = True
+        self.requests.pop(request.id, None)
+        if not request.background:
+            self.emit('progress')
+
+    def cancel_matching(self, **data):
+        """Cancel the requests whose data has all the given items."""
+        for request in self.requests.values():
+            for key, value in data.items():
+                if request.data.get(key) != value:
+                    break
+            else:
+                self.cancel(request)
+
+    def get_progress(self):
+        """Return the fraction done of the foreground requests, or None."""
+        received = total = 0
+        active = False
+        for request in self.requests.values():
+            if request.background:
+                continue
+            active = True
+            # a request sharing a download shows the progress of its own
+            source = request.primary or request
+            if source.total:
+                received += min(source.received, source.total)
+                total += source.total
+        if not active:
+            return None
+        if not total:
+            return 0.0
+        return float(received) / total
+
+    def _work(self):
+        connection = None
+        while True:
+            priority, id, request = self._queue.get()
+            # a request moved up in the queue is in it twice
+            with self._lock:
+                if request.start_time is not None:
+                    continue
+                request.start_time = time.time()
+            if not request.is_wanted():
+                self._done(request)
+                continue
+            wait = self._take_budget(request)
+            if wait:
+                self._defer(request, wait)
+                continue
+
+            start_clock = timing.thread_time()
+            self.fetched += 1
+            try:
+                connection, text = self._fetch(connection, request)
+            except (RequestError, httplib.HTTPException, socket.error) as error:
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                for waiting in self._done(request):
+                    GLib.idle_add(self._error, waiting, str(error))
+                continue
+
+            request.fetch_cpu = timing.elapsed(start_clock)
+            requests = self._done(request)
+            if text is not None:
+                timing.record('download', time.time() - request.start_time,
+                              request.fetch_cpu, source=request.source,
+                              bytes=len(text))
+                self._deliver(requests, text)
+
+    def _take_budget(self, request):
+        """Take a call of the budget, or return the seconds to wait for one."""
+        if self.budget is None:
+            return 0
+        reserve = 0
+        if request.is_background():
+            reserve = BACKGROUND_RESERVE
+        return self.budget.take(reserve)
+
+    def _defer(self, request, wait):
+        """Queue a request again once the budget may have a call for it.
+
+        The worker is left free for other requests in the meantime.
+        """
+        with self._lock:
+            request.start_time = None
+        if not request.throttled:
+            request.throttled = True
+            self.throttled += 1
+            _logger.debug('request %d %s waits %.1fs for the rate limit' % (
+                request.id, request.source, wait))
+        timer = threading.Timer(wait, self._queue.put,
+                                [(request.priority, request.id, request)])
+        timer.daemon = True
+        timer.start()
+
+    def _done(self, request):
+        """End the download of a request, return the requests sharing it."""
+        with self._lock:
+            key = responsecache.normalize(request.source)
+            if self._in_flight.get(key) is request:
+                del self._in_flight[key]
+            requests = [request] + request.followers
+        for follower in request.followers:
+            follower.received = request.received
+            follower.total = request.total
+        return requests
+
+    def _deliver(self, requests, text):
+        # requests alike get the result of a single parse
+        groups = []
+        for request in requests:
+            if request.cancelled:
+                continue
+            for group in groups:
+                if group[0].parse == request.parse and \
+                        group[0].data == request.data:
+                    group.append(request)
+                    break
+            else:
+                groups.append([request])
+
+        for group in groups:
+            if group[0].parse is None:
+                for request in group:
+                    GLib.idle_add(self._finish, request, text)
+            else:
+                priority = min([request.priority for request in group])
+                self._parse_queue.put((priority, group[0].id, group, text))
+
+    def _parse_work(self):
+        while True:
+            priority, id, group, text = self._parse_queue.get()
+            group = [request for request in group if not request.cancelled]
+            if not group:
+                continue
+
+            # no response, however odd, may stop the thread, or every
+            # later request would wait for it forever
+            start_clock = timing.thread_time()
+            try:
+                result = group[0].parse(group[0], text)
+            except Exception as error:
+                if not isinstance(error, (RequestError, ValueError,
+                                          KeyError, TypeError, IndexError)):
+                    _logger.exception('parse of %s failed' % (
+                        group[0].source))
+                for request in group:
+                    GLib.idle_add(self._error, request, str(error))
+                continue
+            parse_cpu = timing.elapsed(start_clock)
+            for request in group:
+                request.parse_cpu = parse_cpu
+                GLib.idle_add(self._finish, request, result)
+
+    def log_stats(self):
+        _logger.debug('requests: %d network calls, %d coalesced, %d '
+                      'throttled' % (self.fetched, self.coalesced,
+                                     self.throttled))
+
+    def _fetch(self, connection, request):
+        path = request.get_path(self.base_path)
+        # a kept alive connection may have been closed by the server
+        # while idle, so a failure on it is retried once on a new one
+        for attempt in range(2):
+            fresh = connection is None
+            if fresh:
+                connection = httplib.HTTPConnection(self.host, self.port,
+                                                    timeout=TIMEOUT)
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                break
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                connection = None
+                if fresh:
+                    raise
+
+        text = self._read(request, response)
+        if response.will_close or text is None:
+            connection.close()
+            connection = None
+
+        if text is None:
+            return connection, None
+
+        content_type = response.getheader('Content-Type', '')
+        if response.status != 200:
+            raise RequestError('HTTP status %d' % (response.status))
+        if content_type.startswith('text/html') or not text:
+            raise RequestError('corrupt download')
+        return connection, text
+
+    def _read(self, request, response):
+        try:
+            request.total = int(response.getheader('Content-Length'))
+        except (TypeError, ValueError):
+            request.total = 0
+
+        chunks = []
+        last_progress = time.time()
+        while request.is_wanted():
+            data = response.read(CHUNK_SIZE)
+            if not data:
+                return ''.join(chunks)
+            chunks.append(data)
+            request.received += len(data)
+
+            now = time.time()
+            if now - last_progress >= PROGRESS_INTERVAL:
+                last_progress = now
+                GLib.idle_add(self._progress, request)
+        return None
+
+    def _progress(self, request):
+        for waiting in [request] + request.followers:
+            if not waiting.cancelled and not waiting.background:
+                self.emit('progress')
+                break
+        return False
+
+    def _finish(self, request, result):
+        # a request superseded while its response was on the way ends here
+        if request.cancelled:
+            return False
+        del self.requests[request.id]
+
+        if request.start_time is not None:
+            _logger.debug('request %d %s: %d bytes, %.3fs wall, %s' % (
+                request.id, request.source, request.received,
+                time.time() - request.start_time, format_cpu(request)))
+
+        if not request.background:
+            self.emit('progress')
+        request.callback(request, result)
+        return False
+
+    def _error(self, request, message):
+        if request.cancelled:
+            return False
+        del self.requests[request.id]
+
+        _logger.debug('request %d %s failed: %s' % (request.id,
+                                                    request.source, message))
+        if not request.background:
+            self.emit('progress')
+        if request.error_callback is not None:
+            request.error_callback(request, message)
+        return False
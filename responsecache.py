@@ -0,0 +1,178 @@
+# responsecache.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+import os
+import time
+import hashlib
+import logging
+import tempfile
+
+from urlparse import parse_qsl
+
+_logger = logging.getLogger('weather-activity')
+
+# seconds a response stays fresh, by endpoint
+TTLS = {'find' : 10 * 60,
+        'group' : 10 * 60,
+        'forecast/daily' : 60 * 60,
+        'forecast' : 30 * 60,
+        'box/city' : 10 * 60}
+
+DEFAULT_TTL = 10 * 60
+
+# total bytes kept on disk
+MAX_SIZE = 2 * 1024 * 1024
+
+def normalize(source):
+    """Return the cache key of an API source string.
+
+    The parameters are sorted and the query text is lowercased, so that
+    'find?q=London&type=like' and 'find?type=like&q= london' share a key.
+    """
+    path, sep, query = source.partition('?')
+    params = []
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        if key == 'q':
+            value = ' '.join(value.lower().split())
+        params.append('%s=%s' % (key, value))
+    return '%s?%s' % (path, '&'.join(sorted(params)))
+
+def get_ttl(source):
+    return TTLS.get(source.partition('?')[0], DEFAULT_TTL)
+
+class ResponseCache(object):
+    """On-disk cache of API responses with a TTL and LRU eviction.
+
+    The modification time of an entry records when it was stored and its
+    access time is bumped on every hit to track recent use. The API URL
+    is part of the key, so responses of another server are never served.
+    """
+
+    def __init__(self, cache_dir, api_url='', max_size=MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.api_url = api_url
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _get_path(self, source):
+        key = hashlib.sha1(self.api_url + normalize(source)).hexdigest()
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get_path(self, source):
+        """Return the path of a fresh cached response, or None."""
+        path = self._get_path(source)
+        now = time.time()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            self.misses += 1
+            return None
+
+        if now - mtime > get_ttl(source):
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path, (now, mtime))
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def contains(self, source):
+        """Return whether a fresh response is cached, leaving the stats."""
+        try:
+            mtime = os.path.getmtime(self._get_path(source))
+        except OSError:
+            return False
+        return time.time() - mtime <= get_ttl(source)
+
+    def get(self, source):
+        """Return the text of a fresh cached response, or None."""
+        path = self.get_path(source)
+        if path is None:
+            return None
+        # the entry may be evicted by a put from another thread meanwhile
+        try:
+            data = open(path, 'r')
+        except IOError:
+            return None
+        try:
+            return data.read()
+        finally:
+            data.close()
+
+    def put(self, source, text):
+        """Store a response, replacing any older entry atomically.
+
+        The cache is best effort, a response that cannot be written, on a
+        full disk for example, is only logged.
+        """
+        path = self._get_path(source)
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                             suffix='.part')
+            data = os.fdopen(fd, 'w')
+            try:
+                data.write(text)
+            finally:
+                data.close()
+            now = time.time()
+            os.utime(temp_path, (now, now))
+            os.rename(temp_path, path)
+            self.evict()
+        except (IOError, OSError) as error:
+            _logger.debug('response to %s not cached: %s' % (source, error))
+            if temp_path is not None:
+                self._remove(temp_path)
+
+    def evict(self):
+        """Remove least recently used entries until under max_size."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_atime, info.st_size, path))
+            total += info.st_size
+
+        entries.sort()
+        for atime, size, path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -24,6 +24,10 @@ from gi.repository import Gdk
 from gi.repository import GdkPixbuf
 
 import os
+import timing
+import profiling
+import cityindex
+import viewmodel
 import openweathermap
 import logging
 
@@ -34,13 +38,17 @@ SCREEN_HEIGHT = Gdk.Screen.height()
 
 _logger = logging.getLogger('weather-activity')
 
+(CITY_COLUMN, ICON_COLUMN, INFO_COLUMN, WIND_COLUMN, CLOUDS_COLUMN,
+ PRESSURE_COLUMN, HUMIDITY_COLUMN) = range(7)
+
 class SearchTreeView(Gtk.TreeView):
     def __init__(self, activity):
         Gtk.TreeView.__init__(self)
         
         self.activity = activity
         
-        self.liststore = Gtk.ListStore(object)
+        self.liststore = Gtk.ListStore(object, GdkPixbuf.Pixbuf, str, str,
+                                       str, str, str)
         
         self.set_grid_lines(Gtk.TreeViewGridLines.HORIZONTAL)
         
@@ -48,38 +56,36 @@ class SearchTreeView(Gtk.TreeView):
         renderer_text = Gtk.CellRendererText()
         renderer_text.set_property('height', SCREEN_HEIGHT / 10)
         
-        column = Gtk.TreeViewColumn('', renderer_pixbuf)
-        column.set_cell_data_func(renderer_pixbuf, self.load_pixbuf)
+        column = Gtk.TreeViewColumn('', renderer_pixbuf, pixbuf=ICON_COLUMN)
         column.set_min_width(SCREEN_WIDTH / 9)
         column.set_max_width(SCREEN_WIDTH / 9)
         self.append_column(column)
         
-        column = Gtk.TreeViewColumn('', renderer_text)
-        column.set_cell_data_func(renderer_text, self.load_info)
+        column = Gtk.TreeViewColumn('', renderer_text, markup=INFO_COLUMN)
         column.set_min_width(SCREEN_WIDTH / 2.6)
         column.set_max_width(SCREEN_WIDTH / 2.6)
         self.append_column(column)
         
-        column = Gtk.TreeViewColumn(_('Wind'), renderer_text)
-        column.set_cell_data_func(renderer_text, self.load_wind)
+        column = Gtk.TreeViewColumn(_('Wind'), renderer_text, 
+                                    text=WIND_COLUMN)
         column.set_min_width(SCREEN_WIDTH / 8)
         column.set_max_width(SCREEN_WIDTH / 8)
         self.append_column(column)
         
-        column = Gtk.TreeViewColumn(_('Clouds'), renderer_text)
-        column.set_cell_data_func(renderer_text, self.load_clouds)
+        column = Gtk.TreeViewColumn(_('Clouds'), renderer_text, 
+                                    text=CLOUDS_COLUMN)
         column.set_min_width(SCREEN_WIDTH / 9)
         column.set_max_width(SCREEN_WIDTH / 9)
         self.append_column(column)
         
-        column = Gtk.TreeViewColumn(_('Pressure'), renderer_text)
-        column.set_cell_data_func(renderer_text, self.load_pressure)
+        column = Gtk.TreeViewColumn(_('Pressure'), renderer_text, 
+                                    text=PRESSURE_COLUMN)
         column.set_min_width(SCREEN_WIDTH / 7)
         column.set_max_width(SCREEN_WIDTH / 7)
         self.append_column(column)
         
-        column = Gtk.TreeViewColumn(_('Humidity'), renderer_text)
-        column.set_cell_data_func(renderer_text, self.load_humidity)
+        column = Gtk.TreeViewColumn(_('Humidity'), renderer_text, 
+                                    text=HUMIDITY_COLUMN)
         self.append_column(column)
         
         self.set_model(self.liststore)
@@ -89,74 +95,27 @@ class SearchTreeView(Gtk.TreeView):
         
         self.show()
     
-    def load_pixbuf(self, column, cell_renderer, model, iter, data):
-        city = model.get_value(iter, 0)
-        
-        file_name = 'icons/%s.svg' % (city.icon[:3])
-        pixbuf = GdkPixbuf.Pixbuf.new_from_file(file_name)
-        
-        cell_renderer.set_property('pixbuf', pixbuf)
-    
-    def load_info(self, column, cell_renderer, model, iter, data):
-        city = model.get_value(iter, 0)
-        
-        name = '%s, %s' % (city.name, city.country)
-        temp = self.activity.convert(city.temp)
-        temp_max = self.activity.convert(city.temp_max)
-        temp_min = self.activity.convert(city.temp_min)
-        
-        info = '<b>%s</b> %s\n<span foreground="white" background="#5FACE0" \
-                > %s%s </span> Temp from %s%s to %s%s' % (name, city.weather, 
-                temp, self.activity.temp_scale,
-                temp_min, self.activity.temp_scale,
-                temp_max, self.activity.temp_scale)
-                
-        cell_renderer.set_property('markup', info)
-    
-    def load_wind(self, column, cell_renderer, model, iter, data):
-        cell_renderer.set_property('text', '')
-        city = model.get_value(iter, 0)
-        if city.wind_speed != None:
-            wind = '\n%s %s' % (city.wind_speed, self.activity.wind_scale)
-            cell_renderer.set_property('text', wind)
-    
-    def load_clouds(self, column, cell_renderer, model, iter, data):
-        cell_renderer.set_property('text', '')
-        city = model.get_value(iter, 0)
-        if city.clouds != None:
-            clouds = '\n   %s %s' % (int(city.clouds), 
-                                    self.activity.cloud_scale)
-            cell_renderer.set_property('text', clouds)
-
-    def load_pressure(self, column, cell_renderer, model, iter, data):
-        cell_renderer.set_property('text', '')
-        city = model.get_value(iter, 0)
-        if city.pressure != None:
-            pressure = '\n%s %s' % (city.pressure, 
-                                   self.activity.pressure_scale)
-            cell_renderer.set_property('text', pressure)
-    
-    def load_humidity(self, column, cell_renderer, model, iter, data):
-        cell_renderer.set_property('text', '')
-        city = model.get_value(iter, 0)
-        if city.humidity != None:
-            humidity = '\n   %s %s' % (int(city.humidity), 
-                                      self.activity.humidity_scale)
-            cell_renderer.set_property('text', humidity)
-    
+    @profiling.profiled
     def treeview_changed(self, selection):
         model, treeiter = selection.get_selected()
         if treeiter != None:
-            self.activity.select_city(model[treeiter][0])
+            self.activity.select_city(model[treeiter][CITY_COLUMN])
     
     def update(self, results):
-        self.set_model(None)
-        self.liststore.clear()
-        
-        for city in results:
-            self.liststore.append([city])
-        
-        self.set_model(self.liststore)
+        with timing.span('SearchTreeView.update', rows=len(results)):
+            self.set_model(None)
+            self.liststore.clear()
+            
+            for city in results:
+                self.liststore.append(viewmodel.city_row(self.activity,
+                                                         city))
+            
+            self.set_model(self.liststore)
+    
+    def update_temperatures(self):
+        for row in self.liststore:
+            row[INFO_COLUMN] = viewmodel.city_info(self.activity, 
+                                                   row[CITY_COLUMN])
 
 class SearchScreen(Gtk.Box):
     def __init__(self, activity):
@@ -164,6 +123,10 @@ class SearchScreen(Gtk.Box):
         
         self.activity = activity
         self.search_results = []
+        self.ranking = None
+        
+        self._city_index = None
+        self._city_index_loaded = False
         
         self.search_treeview = SearchTreeView(self.activity)
         
@@ -177,17 +140,46 @@ class SearchScreen(Gtk.Box):
         
         self.show()
     
-    def search(self):
+    def get_city_index(self):
+        if not self._city_index_loaded:
+            self._city_index_loaded = True
+            path = os.path.join(self.activity.get_bundle_path(),
+                                cityindex.INDEX_FILE)
+            self._city_index = cityindex.load(path)
+        return self._city_index
+    
+    def get_source(self, text):
+        # resolve the name offline when there is an index, so the network
+        # is only asked for the weather of the matching cities
+        index = self.get_city_index()
+        if index is not None:
+            candidates = index.lookup(text, openweathermap.GROUP_LIMIT)
+            if candidates:
+                self.ranking = dict([(entry.id, rank) for rank, entry
+                                     in enumerate(candidates)])
+                ids = [entry.id for entry in candidates]
+                return openweathermap.get_group_sources(ids)[0]
+        
+        self.ranking = None
+        return 'find?q=%s&type=like&mode=json' % (text)
+    
+    def search(self, use_cache=True):
         _logger.debug('searching: %s' % (self.activity.input))
-        source = 'find?q=%s&type=like&mode=json' % (self.activity.input)
-        dest = os.path.join(self.activity.get_activity_root(), 
-                            'tmp', '', 'search.json')
-        self.activity.add_download(source, dest)
+        source = self.get_source(self.activity.input)
+        self.activity.prefetcher.stop()
+        self.activity.add_download(source, self, use_cache=use_cache)
 
-    def download_complete(self, downloader, file_path, file_name):
-        self.search_results = []
-        for result in self.activity.read_file(file_path)['list']:
-            self.search_results.append(openweathermap.City(result))
+    def parse(self, data):
+        # runs on the parse thread
+        return openweathermap.load_cities(data)
+
+    def download_complete(self, request, cities):
+        self.search_results = cities
+        
+        if self.ranking:
+            self.search_results.sort(key=lambda city: self.ranking.get(
+                city.id, len(self.ranking)))
+        self.activity.prefetcher.start(self.search_results)
             
         self.activity.back_button.set_sensitive(False)
         self.activity.forecast_button.set_sensitive(False)
@@ -196,8 +188,11 @@ class SearchScreen(Gtk.Box):
 
     def refresh(self):
         self.activity.search_entry.set_text(self.activity.input)
-        self.search()
+        self.search(use_cache=False)
     
     def display_results(self):
         self.search_treeview.update(self.search_results)
+    
+    def update_temperatures(self):
+        self.search_treeview.update_temperatures()
 
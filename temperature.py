@@ -0,0 +1,43 @@
+# temperature.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+KELVIN = 'K'
+CELSIUS = u'\u00b0C'.encode('utf-8')
+FAHRENHEIT = u'\u00b0F'.encode('utf-8')
+
+# (factor, offset) applied to a temperature in kelvin
+SCALES = {KELVIN : (1.0, 0.0),
+          CELSIUS : (1.0, -273.15),
+          FAHRENHEIT : (1.8, -459.67)}
+
+def convert(kelvin, scale):
+    """Convert one temperature, rounded to a tenth of a degree."""
+    factor, offset = SCALES[scale]
+    return round(kelvin * factor + offset, 1)
+
+def convert_all(values, scale):
+    """Convert a column of temperatures in kelvin to a list.
+
+    Missing values, stored as NaN, come back as None.
+    """
+    factor, offset = SCALES[scale]
+    return [round(value * factor + offset, 1) if value == value else None
+            for value in values]
@@ -0,0 +1,224 @@
+# temperaturelayer.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+from gi.repository import GLib
+
+import math
+import cairo
+import logging
+import fastjson
+import worldmap
+import openweathermap
+import requestmanager
+
+from collections import OrderedDict
+
+_logger = logging.getLogger('weather-activity')
+
+# milliseconds the map has to stay still before the cities are fetched
+FETCH_DELAY = 500
+
+# the API map zoom matching zoom level 0 of world.svg
+API_ZOOM_OFFSET = 2
+
+# view pixels between the clusters of cities
+CLUSTER_SIZE = 48
+
+MARKER_RADIUS = 14
+
+FONT_SIZE = 12
+
+# tiles whose cities are kept, the least recently drawn go first
+MAX_CELLS = 256
+
+def cluster(cities, cell_size, width, height):
+    """Group the cities in square cells of cell_size SVG units.
+
+    Returns (x, y, mean temperature, count) per cell, the position being
+    the mean SVG position of its cities.
+    """
+    cells = {}
+    for city in cities:
+        if city.lon is None or city.lat is None or city.temp is None:
+            continue
+        x, y = worldmap.project(city.lon, city.lat, width, height)
+        key = (int(x / cell_size), int(y / cell_size))
+        cell = cells.get(key)
+        if cell is None:
+            cells[key] = [x, y, city.temp, 1]
+        else:
+            cell[0] += x
+            cell[1] += y
+            cell[2] += city.temp
+            cell[3] += 1
+    return [(x / count, y / count, temp / count, count)
+            for x, y, temp, count in cells.values()]
+
+def get_color(kelvin):
+    """Return a color from blue at -20C to red at 40C."""
+    fraction = max(0.0, min(1.0, (kelvin - 253.15) / 60))
+    return (fraction, 0.3, 1.0 - fraction)
+
+class TemperatureLayer(object):
+    """Current temperatures of the cities in view, drawn over the map.
+
+    The cities of each visible tile are fetched once from the box/city
+    endpoint and kept per tile and zoom level, for the MAX_CELLS tiles
+    seen last. They are clustered per
+    zoom level so that a zoomed out view draws one marker per area.
+    """
+
+    def __init__(self, activity, world_map):
+        self.activity = activity
+        self.world_map = world_map
+        self.enabled = False
+
+        # cities by tile key, least recently seen first
+        self.cells = OrderedDict()
+        self._requests = {}
+        self._clusters = {}
+        self._fetch_id = None
+
+        world_map.connect('view-changed', self.view_changed_cb)
+        world_map.add_overlay(self)
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if enabled:
+            self.fetch()
+        else:
+            if self._fetch_id is not None:
+                GLib.source_remove(self._fetch_id)
+                self._fetch_id = None
+            for request in self._requests.values():
+                self.activity.requests.cancel(request)
+            self._requests = {}
+        self.world_map.queue_draw()
+
+    def view_changed_cb(self, world_map):
+        if not self.enabled:
+            return
+        if self._fetch_id is not None:
+            GLib.source_remove(self._fetch_id)
+        self._fetch_id = GLib.timeout_add(FETCH_DELAY, self._fetch_timeout_cb)
+
+    def _fetch_timeout_cb(self):
+        self._fetch_id = None
+        self.fetch()
+        return False
+
+    def fetch(self):
+        """Request the cities of the visible tiles not fetched yet."""
+        if not self.enabled or self.world_map.scale is None:
+            return
+        visible = self.world_map.get_visible_tiles()
+
+        # tiles panned out of view would only spend the call budget
+        for key in self._requests.keys():
+            if key not in visible:
+                self.activity.requests.cancel(self._requests.pop(key))
+
+        for key in visible:
+            cities = self.cells.pop(key, None)
+            if cities is not None:
+                self.cells[key] = cities
+                continue
+            if key in self._requests:
+                continue
+            west, south, east, north = self.world_map.get_tile_bounds(key)
+            source = openweathermap.get_box_source(
+                west, south, east, north, key[0] + API_ZOOM_OFFSET)
+            text = self.activity.response_cache.get(source)
+            self._requests[key] = self.activity.requests.add(
+                source, self._complete, self._error,
+                priority=requestmanager.PRIORITY_LOW, background=True,
+                parse=self._parse, text=text, cached=text is not None,
+                cell=key)
+
+    def _parse(self, request, text):
+        # runs on the parse thread
+        data = fastjson.loads(text)
+        # a refused tile goes to _error, to be asked for again
+        if str(data.get('cod', 200)) != '200':
+            raise requestmanager.RequestError('cod %s' % (data.get('cod')))
+        cities = openweathermap.load_cities(data)
+        if not request.data['cached']:
+            self.activity.response_cache.put(request.source, text)
+        return cities
+
+    def _complete(self, request, cities):
+        key = request.data['cell']
+        del self._requests[key]
+        self.cells[key] = cities
+        while len(self.cells) > MAX_CELLS:
+            self.cells.popitem(last=False)
+        self._clusters = {}
+        self.world_map.queue_draw()
+
+    def _error(self, request, message):
+        # the tile is asked for again when the view next changes
+        del self._requests[request.data['cell']]
+        _logger.debug('no temperatures for tile %d-%d-%d: %s' % (
+            request.data['cell'] + (message,)))
+
+    def get_clusters(self, zoom):
+        clusters = self._clusters.get(zoom)
+        if clusters is None:
+            # tiles of different zoom levels overlap
+            cities = {}
+            for cell in self.cells.values():
+                for city in cell:
+                    cities[city.id] = city
+            cell_size = float(CLUSTER_SIZE) / 2 ** zoom
+            clusters = cluster(cities.values(), cell_size,
+                               self.world_map.map_width,
+                               self.world_map.map_height)
+            self._clusters[zoom] = clusters
+        return clusters
+
+    def draw(self, world_map, context):
+        if not self.enabled or world_map.scale is None:
+            return
+
+        x, y, width, height = world_map.get_visible()
+        context.select_font_face('Sans', cairo.FONT_SLANT_NORMAL,
+                                 cairo.FONT_WEIGHT_BOLD)
+        context.set_font_size(FONT_SIZE)
+
+        for map_x, map_y, temp, count in self.get_clusters(
+                world_map.get_zoom()):
+            if not (x <= map_x <= x + width and y <= map_y <= y + height):
+                continue
+            view_x, view_y = world_map.to_view(map_x, map_y)
+
+            radius = MARKER_RADIUS
+            if count > 1:
+                radius += min(8, count)
+            context.arc(view_x, view_y, radius, 0, 2 * math.pi)
+            context.set_source_rgb(*get_color(temp))
+            context.fill()
+
+            label = '%d' % (round(self.activity.convert(temp)))
+            extents = context.text_extents(label)
+            context.move_to(view_x - extents[2] / 2 - extents[0],
+                            view_y - extents[3] / 2 - extents[1])
+            context.set_source_rgb(1, 1, 1)
+            context.show_text(label)
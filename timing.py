@@ -0,0 +1,196 @@
+# timing.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+# Timing spans of the download, parse and render stages. Set
+# WEATHER_TIMING=1 to write one JSON line per span to data/timing.log in
+# the activity root, for example
+#
+#     {"stage": "parse", "ms": 12.5, "cpu_ms": 12.1, "time": 1381000000.1}
+#
+# cpu_ms is the CPU time of the thread the stage ran on, where the system
+# can tell it. When WEATHER_TIMING is not set, span() returns a shared
+# object that does nothing.
+
+import os
+import json
+import time
+import logging
+import resource
+import threading
+
+from collections import deque
+
+_logger = logging.getLogger('weather-activity')
+
+ENABLED = bool(os.environ.get('WEATHER_TIMING'))
+
+LOG_FILE = 'timing.log'
+
+# the log is started again from empty when it grows past this size
+MAX_LOG_SIZE = 1024 * 1024
+
+# spans kept per stage for the percentiles
+RECENT = 100
+
+# Linux only, and not named by the resource module of Python 2
+RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD', 1)
+
+def _has_thread_time():
+    try:
+        resource.getrusage(RUSAGE_THREAD)
+    except (ValueError, OSError, resource.error):
+        return False
+    return True
+
+_thread_time = _has_thread_time()
+
+def thread_time():
+    """Return the CPU seconds used by the calling thread, or None."""
+    if not _thread_time:
+        return None
+    usage = resource.getrusage(RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+def elapsed(start):
+    """Return the thread CPU seconds since a thread_time(), or None."""
+    if start is None:
+        return None
+    return thread_time() - start
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class Span(object):
+    __slots__ = ('log', 'stage', 'data', 'start', 'start_clock')
+
+    def __init__(self, log, stage, data):
+        self.log = log
+        self.stage = stage
+        self.data = data
+
+    def __enter__(self):
+        self.start = time.time()
+        self.start_clock = thread_time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.log.record(self.stage, time.time() - self.start,
+                        elapsed(self.start_clock), **self.data)
+        return False
+
+def percentile(values, fraction):
+    """Return the value below which a fraction of the sorted values lie."""
+    if not values:
+        return None
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+class TimingLog(object):
+    """Recent spans per stage, optionally appended to a JSON lines file.
+
+    Spans are recorded from the worker threads as well as the main loop.
+    """
+
+    def __init__(self):
+        self.recent = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+    def open(self, path):
+        try:
+            if os.path.getsize(path) > MAX_LOG_SIZE:
+                os.remove(path)
+        except OSError:
+            pass
+        try:
+            self._file = open(path, 'a')
+        except IOError as error:
+            _logger.debug('timing log not written: %s' % (error))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def record(self, stage, wall, cpu=None, **data):
+        entry = {'stage': stage, 'ms': round(wall * 1000, 3),
+                 'time': round(time.time(), 3)}
+        if cpu is not None:
+            entry['cpu_ms'] = round(cpu * 1000, 3)
+        entry.update(data)
+
+        with self._lock:
+            recent = self.recent.get(stage)
+            if recent is None:
+                recent = self.recent[stage] = deque(maxlen=RECENT)
+            recent.append(wall)
+
+            if self._file is not None:
+                self._file.write(json.dumps(entry) + '\n')
+                self._file.flush()
+
+    def get_stats(self):
+        """Return (stage, count, p50, p95, max) per stage, in seconds."""
+        with self._lock:
+            recent = [(stage, sorted(walls)) for stage, walls
+                      in self.recent.items()]
+
+        stats = []
+        for stage, walls in sorted(recent):
+            stats.append((stage, len(walls), percentile(walls, 0.5),
+                          percentile(walls, 0.95), walls[-1]))
+        return stats
+
+_log = None
+
+def get_log():
+    global _log
+    if _log is None:
+        _log = TimingLog()
+    return _log
+
+def open_log(directory):
+    """Start writing spans to the log file in directory, if enabled."""
+    if ENABLED:
+        get_log().open(os.path.join(directory, LOG_FILE))
+
+def close_log():
+    """Stop writing spans to the log file."""
+    if _log is not None:
+        _log.close()
+
+def span(stage, **data):
+    """Return a context manager timing the stage it wraps."""
+    if not ENABLED:
+        return _NULL_SPAN
+    return Span(get_log(), stage, data)
+
+def record(stage, wall, cpu=None, **data):
+    """Record a stage timed elsewhere, such as a download."""
+    if ENABLED:
+        get_log().record(stage, wall, cpu, **data)
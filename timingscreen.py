@@ -0,0 +1,98 @@
+# timingscreen.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+from gi.repository import Gtk
+from gi.repository import GLib
+
+import timing
+
+# seconds between two updates of the table while it is shown
+UPDATE_INTERVAL = 1
+
+(STAGE_COLUMN, COUNT_COLUMN, P50_COLUMN, P95_COLUMN, MAX_COLUMN) = range(5)
+
+def format_ms(seconds):
+    return '%.1f ms' % (seconds * 1000)
+
+class TimingScreen(Gtk.Box):
+    """Debug table of the recent timing spans, per stage."""
+
+    def __init__(self, activity):
+        Gtk.Box.__init__(self)
+
+        self.activity = activity
+        self._update_id = None
+
+        self.liststore = Gtk.ListStore(str, int, str, str, str)
+
+        self.treeview = Gtk.TreeView(self.liststore)
+        self.treeview.set_grid_lines(Gtk.TreeViewGridLines.HORIZONTAL)
+
+        renderer_text = Gtk.CellRendererText()
+        for title, column_id in [('Stage', STAGE_COLUMN),
+                                 ('Count', COUNT_COLUMN),
+                                 ('p50', P50_COLUMN),
+                                 ('p95', P95_COLUMN),
+                                 ('Max', MAX_COLUMN)]:
+            column = Gtk.TreeViewColumn(title, renderer_text, text=column_id)
+            column.set_expand(column_id == STAGE_COLUMN)
+            self.treeview.append_column(column)
+        self.treeview.show()
+
+        self.scroll = Gtk.ScrolledWindow()
+        self.scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        self.scroll.add(self.treeview)
+        self.scroll.show()
+
+        self.set_orientation(Gtk.Orientation.VERTICAL)
+        self.pack_start(self.scroll, expand=True, fill=True, padding=0)
+
+        self.connect('map', self.map_cb)
+        self.connect('unmap', self.unmap_cb)
+
+        self.show()
+
+    def map_cb(self, widget):
+        self.display_results()
+        if self._update_id is None:
+            self._update_id = GLib.timeout_add_seconds(UPDATE_INTERVAL,
+                                                       self._update_cb)
+
+    def unmap_cb(self, widget):
+        if self._update_id is not None:
+            GLib.source_remove(self._update_id)
+            self._update_id = None
+
+    def _update_cb(self):
+        self.display_results()
+        return True
+
+    def refresh(self):
+        self.display_results()
+
+    def display_results(self):
+        self.liststore.clear()
+        for stage, count, p50, p95, longest in timing.get_log().get_stats():
+            self.liststore.append([stage, count, format_ms(p50),
+                                   format_ms(p95), format_ms(longest)])
+
+    def update_temperatures(self):
+        pass
@@ -0,0 +1,127 @@
+# viewmodel.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+# Display strings for the tree view rows. They are computed once when
+# results arrive and stored in the list stores, so that painting a row
+# does not format anything. Only the temperature markup depends on the
+# selected scale and is recomputed when the scale changes.
+
+import iconcache
+
+from datetime import datetime
+from gettext import gettext as _
+from gettext import ngettext
+
+calendar = [_('Jan'), _('Feb'), _('Mar'), _('Apr'), _('May'), _('Jun'),
+            _('Jul'), _('Aug'), _('Sep'), _('Oct'), _('Nov'), _('Dec')]
+
+week = [_('Monday'), _('Tuesday'), _('Wednesday'), _('Thursday'),
+        _('Friday'), _('Saturday'), _('Sunday')]
+
+def measure(value, scale, template='\n%s %s', to_int=False):
+    if value is None:
+        return ''
+    if to_int:
+        value = int(value)
+    return template % (value, scale)
+
+def city_info(activity, city):
+    name = '%s, %s' % (city.name, city.country)
+    temp = activity.convert(city.temp)
+    temp_max = activity.convert(city.temp_max)
+    temp_min = activity.convert(city.temp_min)
+
+    return '<b>%s</b> %s\n<span foreground="white" background="#5FACE0" \
+            > %s%s </span> Temp from %s%s to %s%s' % (name, city.weather,
+            temp, activity.temp_scale,
+            temp_min, activity.temp_scale,
+            temp_max, activity.temp_scale)
+
+def city_row(activity, city):
+    return [city,
+            iconcache.get_pixbuf(city.icon),
+            city_info(activity, city),
+            measure(city.wind_speed, activity.wind_scale),
+            measure(city.clouds, activity.cloud_scale, '\n   %s %s', True),
+            measure(city.pressure, activity.pressure_scale),
+            measure(city.humidity, activity.humidity_scale, '\n   %s %s',
+                    True)]
+
+def forecast_date(forecast):
+    timestamp = datetime.fromtimestamp(forecast['date'])
+    return '        %s %d' % (calendar[timestamp.month - 1], timestamp.day)
+
+def forecast_info(activity, forecast):
+    temp_day = forecast.converted('temp_day', activity.temp_scale)
+    temp_night = forecast.converted('temp_night', activity.temp_scale)
+
+    return '<span foreground="black" background="#FFE578" \
+            > %s%s </span>  <span foreground="white" background="#4264BA" \
+            > %s%s </span>\n%s' % (temp_day, activity.temp_scale,
+            temp_night, activity.temp_scale, forecast['weather'])
+
+def forecast_row(activity, forecast):
+    return [forecast,
+            forecast_date(forecast),
+            iconcache.get_pixbuf(forecast['icon']),
+            forecast_info(activity, forecast),
+            measure(forecast['wind_speed'], activity.wind_scale),
+            measure(forecast['clouds'], activity.cloud_scale,
+                    '\n    %s %s', True),
+            measure(forecast['pressure'], activity.pressure_scale),
+            measure(forecast['humidity'], activity.humidity_scale,
+                    '\n    %s %s', True)]
+
+def hourly_time(forecast):
+    timestamp = datetime.fromtimestamp(forecast['date'])
+    return '%s\n%02d:%02d' % (week[timestamp.weekday()], timestamp.hour,
+                              timestamp.minute)
+
+def hourly_info(activity, forecast):
+    temp = forecast.converted('temp', activity.temp_scale)
+
+    return '<span foreground="white" background="#5FACE0" \
+            > %s%s </span>\n%s' % (temp, activity.temp_scale,
+            forecast['weather'])
+
+def hourly_strings(activity, forecast):
+    """Return the display strings of an hourly step, by column name."""
+    return {'time' : hourly_time(forecast),
+            'info' : hourly_info(activity, forecast),
+            'wind' : measure(forecast['wind_speed'], activity.wind_scale),
+            'clouds' : measure(forecast['clouds'], activity.cloud_scale,
+                               '\n    %s %s', True),
+            'pressure' : measure(forecast['pressure'],
+                                 activity.pressure_scale),
+            'humidity' : measure(forecast['humidity'],
+                                 activity.humidity_scale, '\n    %s %s',
+                                 True)}
+
+def format_age(seconds):
+    """Return how long ago something happened, in the largest unit."""
+    minutes = max(0, int(seconds / 60))
+    if minutes < 60:
+        return ngettext('%d minute', '%d minutes', minutes) % (minutes)
+    hours = minutes / 60
+    if hours < 48:
+        return ngettext('%d hour', '%d hours', hours) % (hours)
+    days = hours / 24
+    return ngettext('%d day', '%d days', days) % (days)
@@ -21,62 +21,73 @@
 
 from gi.repository import Gtk
 from gi.repository import Gdk
-from gi.repository import GdkPixbuf
+from gi.repository import GObject
 
+import os
 import json
+import time
 import gobject
+import timing
 import logging
+import fastjson
+import profiling
+import prefetch
+import worldmap
+import iconcache
+import temperature
 import searchscreen
-import forecastscreen
+import responsecache
+import requestmanager
 
-from fractions import Fraction
 from gettext import gettext as _
 
-from sugar3 import network
-
 from sugar3.activity import activity
 from sugar3.activity.widgets import StopButton
 from sugar3.activity.widgets import ActivityToolbarButton
 
-from sugar3.graphics import style
 from sugar3.graphics import iconentry
-from sugar3.graphics.alert import ConfirmationAlert
 from sugar3.graphics.toolbarbox import ToolbarBox
 from sugar3.graphics.toolbutton import ToolButton
 from sugar3.graphics.toolcombobox import ToolComboBox
+from sugar3.graphics.toggletoolbutton import ToggleToolButton
 from sugar3.graphics.toolbarbox import ToolbarButton
 
 _logger = logging.getLogger('weather-activity')
 
+GObject.threads_init()
+
+# format of the state saved in the journal, entries of other versions
+# are ignored
+JOURNAL_VERSION = 1
+
+# seconds from process start to the first paint of the activity
+STARTUP_BUDGET = 3.0
+
+# milliseconds of typing pause before a search starts
+SEARCH_DELAY = 500
+
+# shortest text searched while typing
+SEARCH_MIN_LENGTH = 3
+
 SCREEN_WIDTH = Gdk.Screen.width()
 SCREEN_HEIGHT = Gdk.Screen.height()
 
-GREY = style.COLOR_PANEL_GREY.get_html()
-
 howto = _('Enter the city\'s name to get a list of the most proper cities in \
 the world. \nIf you put a more precise name, you will get a more precise list.\
 \nExample - <b>Lon</b> or <b>Lond</b> or <b>London</b>.')
 
-class ReadURLDownloader(network.GlibURLDownloader):
-    """URLDownloader that provides content-length and content-type."""
-    
-    CHUNK_SIZE = 32
-
-    def get_content_length(self):
-        """Return the content-length of the download."""
-        if self._info is not None:
-            try:
-                return int(self._info.headers.get('Content-Length'))
-            except TypeError:
-                return 50
-
-    def get_content_type(self):
-        """Return the content-type of the download."""
-        if self._info is not None:
-            return self._info.headers.get('Content-Type')
+def get_process_age():
+    """Return the seconds since this process was started, or None."""
+    try:
+        with open('/proc/self/stat') as stat:
+            # the fields after the command name, starttime is field 22
+            fields = stat.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as uptime:
+            seconds = float(uptime.read().split()[0])
+        return seconds - float(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, IndexError, ValueError):
         return None
 
-
 class WeatherActivity(activity.Activity):
     """WeatherActivity class as specified in activity.info"""
 
@@ -92,13 +103,32 @@ class WeatherActivity(activity.Activity):
         self.pressure_scale = 'hPa'
         self.humidity_scale = '%'
         self.cloud_scale = '%'
-        self.temp_scale = 'K'
+        self.temp_scale = temperature.KELVIN
         self.input = ''
         self.selected_city = None
-        
-        self.temp_scales = {'Kelvin' : 'K',
-                            'Celcius' : u'\u00b0C'.encode('utf-8'),
-                            'Farenheit' : u'\u00b0F'.encode('utf-8')}
+        self.favorites = self.load_favorites()
+        self._search_id = None
+        
+        self.requests = requestmanager.RequestManager()
+        self.requests.connect('progress', self.requests_progress_cb)
+        self.prefetcher = prefetch.Prefetcher(self)
+        # built with the forecast screen, the only one it refreshes
+        self.auto_refresh = None
+        self._obscured = False
+        
+        self.response_cache = responsecache.ResponseCache(
+            os.path.join(self.get_activity_root(), 'data', 'cache'),
+            requestmanager.API_URL)
+        timing.open_log(os.path.join(self.get_activity_root(), 'data'))
+        profiling.start(os.path.join(self.get_activity_root(), 'data'))
+        self.timing_screen = None
+        # the screen, canvas and button states the back button restores
+        # when leaving the timing screen
+        self._timing_return = None
+        
+        self.temp_scales = {'Kelvin' : temperature.KELVIN,
+                            'Celcius' : temperature.CELSIUS,
+                            'Farenheit' : temperature.FAHRENHEIT}
         
         # view toolbar
         view_toolbar = Gtk.Toolbar()
@@ -131,6 +161,32 @@ class WeatherActivity(activity.Activity):
         
         view_toolbar.insert(temp_label_item, -1)
         view_toolbar.insert(temp_scale_combo_item, -1)
+        
+        zoom_in_button = ToolButton('zoom-in')
+        zoom_in_button.connect('clicked', self.zoom_in_button_clicked)
+        zoom_in_button.set_tooltip(_('Zoom in'))
+        view_toolbar.insert(zoom_in_button, -1)
+        zoom_in_button.show()
+        
+        zoom_out_button = ToolButton('zoom-out')
+        zoom_out_button.connect('clicked', self.zoom_out_button_clicked)
+        zoom_out_button.set_tooltip(_('Zoom out'))
+        view_toolbar.insert(zoom_out_button, -1)
+        zoom_out_button.show()
+        
+        temperatures_button = ToggleToolButton('01d')
+        temperatures_button.connect('toggled',
+                                    self.temperatures_button_toggled)
+        temperatures_button.set_tooltip(_('Temperatures on the map'))
+        view_toolbar.insert(temperatures_button, -1)
+        temperatures_button.show()
+        
+        if timing.ENABLED:
+            timing_button = ToolButton('computer-xo')
+            timing_button.connect('clicked', self.timing_button_clicked)
+            timing_button.set_tooltip(_('Timings'))
+            view_toolbar.insert(timing_button, -1)
+            timing_button.show()
         view_toolbar.show()
         
         view_toolbar_button = ToolbarButton(icon_name='toolbar-view', 
@@ -147,6 +203,7 @@ class WeatherActivity(activity.Activity):
         
         self.search_entry = iconentry.IconEntry()
         self.search_entry.connect('key-press-event', self.entry_key_press_cb)
+        self.search_entry.connect('changed', self.entry_changed_cb)
         self.search_entry.connect('icon-press', self.refresh)
         self.search_entry.show()
         
@@ -170,6 +227,19 @@ class WeatherActivity(activity.Activity):
         toolbar_box.toolbar.insert(self.forecast_button, -1)
         self.forecast_button.show()
         
+        self.favorite_button = ToggleToolButton('emblem-favorite')
+        self.favorite_button.connect('toggled', self.favorite_button_toggled)
+        self.favorite_button.set_sensitive(False)
+        self.favorite_button.set_tooltip(_('Add to favorites'))
+        toolbar_box.toolbar.insert(self.favorite_button, -1)
+        self.favorite_button.show()
+        
+        dashboard_button = ToolButton('view-list')
+        dashboard_button.connect('clicked', self.dashboard_button_clicked)
+        dashboard_button.set_tooltip(_('Favorites'))
+        toolbar_box.toolbar.insert(dashboard_button, -1)
+        dashboard_button.show()
+        
         separator = Gtk.SeparatorToolItem()
         toolbar_box.toolbar.insert(separator, -1)
         separator.set_draw(False)
@@ -185,36 +255,85 @@ class WeatherActivity(activity.Activity):
         
         # set up screen
         self.search_screen = searchscreen.SearchScreen(self)
-        self.forecast_screen = forecastscreen.ForecastScreen(self)
+        # built on first use of their buttons
+        self.forecast_screen = None
+        self.dashboard_screen = None
         
         self.screen = self.search_screen
+        # the screen the back button returns to
+        self.list_screen = self.search_screen
         
         howto_label = Gtk.Label()
         howto_label.set_justify(Gtk.Justification.CENTER)
         howto_label.set_markup(howto)
         howto_label.show()
         
-        world_image = Gtk.Image()
-        world_image.modify_bg(Gtk.StateType.NORMAL, 
-                              Gdk.Color.parse(GREY)[1])
-        pixbuf = GdkPixbuf.Pixbuf.new_from_file('world.svg')
-        scaled_pixbuf = pixbuf.scale_simple(SCREEN_WIDTH, SCREEN_HEIGHT - 170, 
-                                            GdkPixbuf.InterpType.BILINEAR)
-        world_image.set_from_pixbuf(scaled_pixbuf)
-        world_image.show()
+        self.world_map = worldmap.WorldMap(
+            os.path.join(self.get_activity_root(), 'data'))
+        self.world_map.set_size_request(-1, SCREEN_HEIGHT - 170)
+        self.world_map.show()
+        # built when the temperatures are first turned on
+        self.temperature_layer = None
         
         box = Gtk.Box()
         box.set_orientation(Gtk.Orientation.VERTICAL)
         box.pack_start(howto_label, expand=True, fill=False, padding=0)
-        box.pack_start(world_image, expand=True, fill=True, padding=0)
+        box.pack_start(self.world_map, expand=True, fill=True, padding=0)
         box.show()
         
         self.set_canvas(box)
         
         self.temp_scale_combo.set_active(1)
         self.search_entry.grab_focus()
+        
+        self._first_draw_id = self.connect('draw', self._first_draw_cb)
+        
+        # the refresh pauses while the activity is not seen
+        self.add_events(Gdk.EventMask.VISIBILITY_NOTIFY_MASK)
+        self.connect('visibility-notify-event', self.visibility_notify_cb)
+        self.connect('notify::active', self.active_changed_cb)
+    
+    def _first_draw_cb(self, widget, context):
+        self.disconnect(self._first_draw_id)
+        
+        startup_time = get_process_age()
+        if startup_time is None:
+            return False
+        
+        if startup_time > STARTUP_BUDGET:
+            _logger.warning('startup took %.2fs, over the %.2fs budget' % (
+                startup_time, STARTUP_BUDGET))
+        else:
+            _logger.debug('startup took %.2fs (budget %.2fs)' % (
+                startup_time, STARTUP_BUDGET))
+        return False
+    
+    def visibility_notify_cb(self, widget, event):
+        self._obscured = \
+            event.state == Gdk.VisibilityState.FULLY_OBSCURED
+        self.update_visible()
+    
+    def active_changed_cb(self, widget, pspec):
+        self.update_visible()
+    
+    def update_visible(self):
+        if self.auto_refresh is not None:
+            self.auto_refresh.set_visible(self.props.active and
+                                          not self._obscured)
+    
+    def set_canvas(self, canvas):
+        activity.Activity.set_canvas(self, canvas)
+        if self.auto_refresh is None:
+            return
+        # only the city of the forecast screen is refreshed
+        if canvas is self.forecast_screen:
+            self.auto_refresh.watch(self.selected_city)
+        else:
+            self.auto_refresh.watch(None)
     
     def _alert_confirmation(self):
+        from sugar3.graphics.alert import ConfirmationAlert
+        
         alert = ConfirmationAlert()
         alert.remove_button(Gtk.ResponseType.CANCEL)
         alert.props.title = (_('Download Error'))
@@ -222,104 +341,304 @@ class WeatherActivity(activity.Activity):
         alert.connect('response', self._alert_response)
         self.add_alert(alert)
     
+    def _alert_saved(self, age):
+        from sugar3.graphics.alert import ConfirmationAlert
+        import viewmodel
+        
+        alert = ConfirmationAlert()
+        alert.remove_button(Gtk.ResponseType.CANCEL)
+        alert.props.title = (_('Saved weather'))
+        alert.props.msg = (_('These results are %s old, refresh to update '
+                             'them') % (viewmodel.format_age(age)))
+        alert.connect('response', self._alert_response)
+        self.add_alert(alert)
+    
     def _alert_response(self, alert, response_id):
         self.remove_alert(alert)
     
+    @profiling.profiled
     def entry_key_press_cb(self, widget, event):
         keyname = Gdk.keyval_name(event.keyval)
         if keyname == 'Return':
             self.set_focus(None)
-            self.input = widget.get_text()
-            
-            self.search_screen.search()
-            
-            self.screen = self.search_screen
+            self.start_search(widget.get_text())
     
-    def read_file(self, file):
-        data = open(file, 'r')
-        try:
-            text = data.read()
-            dict = json.loads(text)
-            return dict
-        finally:
-            data.close()
-    
-    def add_download(self, source, dest):
-        self.search_entry.set_progress_fraction(0.2)
-        gobject.idle_add(self.download, source, dest)
-
-    def download(self, source, dest):
-        id = '43ae262450afb936759b9e905323c7e5'
-        url = 'http://api.openweathermap.org/data/2.5/%s&APPID=%s' % (source,
-                                                                      id)
-        _logger.debug(url)
-        downloader = ReadURLDownloader(url)
+    def entry_changed_cb(self, entry):
+        if self._search_id is not None:
+            gobject.source_remove(self._search_id)
+            self._search_id = None
+        
+        text = entry.get_text()
+        # refresh puts the last search back in the entry
+        if text == self.input or len(text.strip()) < SEARCH_MIN_LENGTH:
+            return
+        self._search_id = gobject.timeout_add(SEARCH_DELAY, 
+                                              self._search_timeout_cb)
+    
+    @profiling.profiled
+    def _search_timeout_cb(self):
+        self._search_id = None
+        self.start_search(self.search_entry.get_text())
+        return False
+    
+    def start_search(self, text):
+        if self._search_id is not None:
+            gobject.source_remove(self._search_id)
+            self._search_id = None
         
-        downloader.connect("error", self._alert_confirmation)
-        downloader.connect("progress", self.get_download_progress)
-        downloader.connect("finished", self.download_complete)
+        self.input = text
+        self.search_screen.search()
         
-        try:
-            downloader.start(dest)
+        self.screen = self.search_screen
+    
+    def add_download(self, source, screen, supersede=True, use_cache=True,
+                     **data):
+        # a new request of a screen supersedes the one in flight
+        if supersede:
+            self.requests.cancel_matching(screen=screen)
+        
+        # a refresh asked for by the user goes to the network
+        text = None
+        if use_cache:
+            text = self.response_cache.get(source)
+        if text is not None:
+            _logger.debug('cache hit %s (%d hits, %d misses)' % (source,
+                self.response_cache.hits, self.response_cache.misses))
+        
+        # a cached response is only parsed
+        self.requests.add(source, self.download_complete, self.download_error,
+                          parse=self.parse_response, text=text,
+                          cached=text is not None, screen=screen, **data)
+        self.requests_progress_cb(self.requests)
+    
+    def parse_response(self, request, text):
+        # runs on the parse thread of the request manager, so it builds
+        # the models of the screen but must not touch any widget
+        with timing.span('parse', bytes=len(text)):
+            try:
+                data = fastjson.loads(text)
+            except ValueError:
+                raise requestmanager.RequestError('corrupt download')
             
-        except:
-            _logger.debug('download error')
-            self._alert_confirmation()
-        
-        self.download_size = downloader.get_content_length()
-        self.download_type = downloader.get_content_type()
-        _logger.debug('size ' + str(self.download_size))
-        _logger.debug('type ' + str(self.download_type) + '\n')
-
-    def download_complete(self, downloader, file_path, file_name):
-        self.search_entry.set_progress_fraction(0)
-        file_type = self.download_type
-        
-        if file_type.startswith('text/html') or self.download_size < 1:
-            _logger.debug('corrupt download')
-            self._alert_confirmation()
-        else:
-            if self.read_file(file_path)['cod'] == '200':
-                self.screen.download_complete(downloader, file_path, file_name)
-                
-            self.screen.display_results()
-            self.show_refresh_button()
+            # group responses carry no cod
+            if str(data.get('cod', 200)) != '200':
+                return None
+            result = request.data['screen'].parse(data)
+        
+        if not request.data['cached']:
+            self.response_cache.put(request.source, text)
+        return result
     
-    def get_download_progress(self, downloader, bytes_downloaded):
-        if self.download_size:
-            self.update_progressbar(bytes_downloaded,  self.download_size)
-        while Gtk.events_pending():
-            Gtk.main_iteration()
+    @profiling.profiled
+    def download_error(self, request, message):
+        self._alert_confirmation()
     
-    def update_progressbar(self, bytes, total):
-        fraction = self.search_entry.get_progress_fraction() + \
-                   (float(bytes) / float(total))
-        self.search_entry.set_progress_fraction(fraction)
+    @profiling.profiled
+    def download_complete(self, request, result):
+        screen = request.data['screen']
+        name = screen.__class__.__name__
+        with timing.span('download_complete', source=request.source):
+            if result is not None:
+                with timing.span(name + '.download_complete'):
+                    screen.download_complete(request, result)
+            
+            with timing.span(name + '.display_results'):
+                screen.display_results()
+            self.show_refresh_button()
+        iconcache.get_cache().log_stats()
+        self.requests.log_stats()
+    
+    def requests_progress_cb(self, manager):
+        fraction = manager.get_progress()
+        if fraction is None:
+            self.search_entry.set_progress_fraction(0)
+        else:
+            self.search_entry.set_progress_fraction(0.2 + 0.8 * fraction)
     
+    @profiling.profiled
     def back_button_clicked(self, widget):
-        self.search_screen.display_results()
+        if self.screen is self.timing_screen:
+            self.screen, canvas, back, forecast = self._timing_return
+            # the scale may have changed meanwhile
+            self.screen.update_temperatures()
+            widget.set_sensitive(back)
+            self.forecast_button.set_sensitive(forecast)
+            self.set_canvas(canvas)
+            return
+        
+        if self.forecast_screen is not None:
+            self.requests.cancel_matching(screen=self.forecast_screen)
+            self.requests.cancel_matching(
+                screen=self.forecast_screen.forecast_hourly_treeview)
+        self.list_screen.display_results()
         widget.set_sensitive(False)
         self.forecast_button.set_sensitive(False)
         
-        self.screen = self.search_screen
+        self.screen = self.list_screen
         self.set_canvas(self.screen)
 
+    def get_forecast_screen(self):
+        if self.forecast_screen is None:
+            import forecastscreen
+            import autorefresh
+            self.forecast_screen = forecastscreen.ForecastScreen(self)
+            self.auto_refresh = autorefresh.AutoRefresh(self)
+            self.update_visible()
+        return self.forecast_screen
+    
+    @profiling.profiled
     def forecast_button_clicked(self, widget):
-        self.forecast_screen.get_daily_forecast()
+        self.requests.cancel_matching(screen=self.search_screen)
+        self.get_forecast_screen().get_daily_forecast()
         widget.set_sensitive(False)
         self.back_button.set_sensitive(True)
         
+        if self.screen is not self.forecast_screen:
+            self.list_screen = self.screen
         self.screen = self.forecast_screen
     
+    def dashboard_button_clicked(self, widget):
+        if self.dashboard_screen is None:
+            import dashboardscreen
+            self.dashboard_screen = dashboardscreen.DashboardScreen(self)
+        
+        self.back_button.set_sensitive(False)
+        self.forecast_button.set_sensitive(False)
+        
+        self.screen = self.list_screen = self.dashboard_screen
+        self.set_canvas(self.screen)
+        self.screen.refresh(use_cache=True)
+        self.show_refresh_button()
+    
+    def zoom_in_button_clicked(self, widget):
+        self.world_map.zoom_in()
+    
+    def zoom_out_button_clicked(self, widget):
+        self.world_map.zoom_out()
+    
+    def temperatures_button_toggled(self, button):
+        if self.temperature_layer is None:
+            import temperaturelayer
+            self.temperature_layer = temperaturelayer.TemperatureLayer(
+                self, self.world_map)
+        self.temperature_layer.set_enabled(button.get_active())
+    
+    def timing_button_clicked(self, widget):
+        if self.timing_screen is None:
+            import timingscreen
+            self.timing_screen = timingscreen.TimingScreen(self)
+        
+        if self.screen is not self.timing_screen:
+            # the back button returns to the screen shown before
+            self._timing_return = (self.screen, self.get_canvas(),
+                                   self.back_button.get_sensitive(),
+                                   self.forecast_button.get_sensitive())
+        self.back_button.set_sensitive(True)
+        self.forecast_button.set_sensitive(False)
+        self.screen = self.timing_screen
+        self.set_canvas(self.timing_screen)
+    
+    def can_close(self):
+        timing.close_log()
+        return True
+    
+    def write_file(self, file_path):
+        """Save the last results and the selected city to the journal."""
+        city = self.selected_city
+        screen = self.screen
+        if screen is self.timing_screen:
+            screen = self._timing_return[0]
+        state = {'version' : JOURNAL_VERSION,
+                 'time' : int(time.time()),
+                 'input' : self.input,
+                 'results' : [result.to_record(forecasts=False) for result
+                              in self.search_screen.search_results],
+                 'selected' : city and city.to_record(),
+                 'forecast' : screen is self.forecast_screen}
+        
+        with open(file_path, 'w') as journal:
+            json.dump(state, journal, separators=(',', ':'))
+    
+    def read_file(self, file_path):
+        """Show the results saved in the journal, before any download."""
+        import openweathermap
+        
+        try:
+            with open(file_path) as journal:
+                state = json.load(journal)
+            if state.get('version') != JOURNAL_VERSION:
+                return
+            results = [openweathermap.City.from_record(record)
+                       for record in state['results']]
+            city = None
+            if state['selected'] is not None:
+                city = openweathermap.City.from_record(state['selected'])
+        except (IOError, ValueError, KeyError, TypeError) as error:
+            _logger.debug('journal entry not restored: %s' % (error))
+            return
+        
+        if city is not None:
+            results = [city if result.id == city.id else result
+                       for result in results]
+        
+        # entry_changed_cb does not search again for the current input
+        self.input = state['input'].encode('utf-8')
+        self.search_entry.set_text(self.input)
+        
+        # an entry where nothing was searched keeps the map and how-to
+        if not results and city is None:
+            return
+        
+        self.search_screen.search_results = results
+        self.search_screen.display_results()
+        self.screen = self.list_screen = self.search_screen
+        self.set_canvas(self.screen)
+        
+        if city is not None:
+            self.select_city(city)
+            if state['forecast'] and len(city.forecast_daily):
+                self.forecast_button.set_sensitive(False)
+                self.back_button.set_sensitive(True)
+                self.screen = self.get_forecast_screen()
+                self.screen.display_results()
+                self.set_canvas(self.screen)
+        
+        self.show_refresh_button()
+        self._alert_saved(time.time() - state['time'])
+    
+    def load_favorites(self):
+        if self.metadata is None or 'favorites' not in self.metadata:
+            return []
+        try:
+            return json.loads(self.metadata['favorites'])
+        except ValueError:
+            return []
+    
+    def favorite_button_toggled(self, button):
+        city = self.selected_city
+        if city is None or button.get_active() == (city.id in self.favorites):
+            return
+        
+        if button.get_active():
+            self.favorites.append(city.id)
+        else:
+            self.favorites.remove(city.id)
+        self.metadata['favorites'] = json.dumps(self.favorites)
+        
+        if self.screen is self.dashboard_screen:
+            self.screen.display_results()
+    
     def show_refresh_button(self):
         self.search_entry.set_icon_from_name(iconentry.ICON_ENTRY_SECONDARY, 
                                             'refresh')
     
+    @profiling.profiled
     def refresh(self, entry, icon_pos, button):
         self.set_focus(None)
         screen = self.get_canvas()
         screen.refresh()
     
+    @profiling.profiled
     def temp_scale_combo_toggled(self, combo):
         tree_iter = combo.get_active_iter()
         if tree_iter != None:
@@ -327,17 +646,14 @@ class WeatherActivity(activity.Activity):
             scale = model[tree_iter][0]
             self.temp_scale = self.temp_scales[scale]
             
-            self.screen.display_results()
+            self.screen.update_temperatures()
+            self.world_map.queue_draw()
     
     def convert(self, kelvin):
-        if self.temp_scale == self.temp_scales['Celcius']:
-            temp = kelvin - 273.15
-        elif self.temp_scale == self.temp_scales['Farenheit']:
-            temp = (kelvin * Fraction(9,5)) - 459.67
-        else:
-            temp = kelvin
-        return round(temp, 1)
+        return temperature.convert(kelvin, self.temp_scale)
     
     def select_city(self, city):
         self.selected_city = city
         self.forecast_button.set_sensitive(True)
+        self.favorite_button.set_sensitive(True)
+        self.favorite_button.set_active(city.id in self.favorites)
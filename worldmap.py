@@ -0,0 +1,470 @@
+# worldmap.py
+#
+# Copyright (C) 2013 Matthew Rahing
+#
+# This program is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software
+# Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General
+# Public License along with this program; if not, write
+# to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301  USA
+
+# Zoomable world map drawn from square tiles of world.svg. Positions on
+# the map are in the units of the SVG, where zoom level z renders 2 ** z
+# pixels per unit. Tiles are rendered on a thread, kept as PNG files in
+# a size capped cache on disk and as surfaces in a small memory cache,
+# and only the tiles in view are painted.
+
+from gi.repository import Gtk
+from gi.repository import Gdk
+from gi.repository import GLib
+from gi.repository import Rsvg
+from gi.repository import GObject
+
+import os
+import glob
+import cairo
+import Queue
+import shutil
+import logging
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+_logger = logging.getLogger('weather-activity')
+
+WORLD_SVG = 'world.svg'
+
+TILE_SIZE = 256
+
+# deepest zoom level, with 2 ** MAX_ZOOM pixels per SVG unit
+MAX_ZOOM = 3
+
+# zooming in goes up to twice the scale of the deepest tiles
+MAX_SCALE = 2 ** (MAX_ZOOM + 1)
+
+ZOOM_STEP = 1.25
+
+# tile surfaces kept in memory, 256KB each
+MEMORY_TILES = 64
+
+# bytes of PNG tiles kept on disk
+MAX_CACHE_SIZE = 16 * 1024 * 1024
+
+BACKGROUND = (0xA6 / 255.0, 0xA6 / 255.0, 0xA6 / 255.0)
+
+def project(lon, lat, width, height):
+    """Return the SVG position of a longitude and latitude.
+
+    world.svg is an equirectangular map of the whole globe.
+    """
+    return (lon + 180.0) / 360 * width, (90.0 - lat) / 180 * height
+
+def unproject(x, y, width, height):
+    """Return the longitude and latitude of an SVG position."""
+    return x / width * 360 - 180.0, 90.0 - y / height * 180
+
+def get_tile_dir(cache_dir):
+    """Return the tile directory for the current world.svg."""
+    mtime = int(os.path.getmtime(WORLD_SVG))
+    return os.path.join(cache_dir, 'tiles-%d' % (mtime))
+
+class TileCache(object):
+    """PNG tiles on disk, evicting the least recently used over a size.
+
+    Only the render thread uses it.
+    """
+
+    def __init__(self, tile_dir, max_size=MAX_CACHE_SIZE):
+        self.tile_dir = tile_dir
+        self.max_size = max_size
+        # bytes on disk, counted by the first evict()
+        self.size = None
+
+        if not os.path.exists(tile_dir):
+            os.makedirs(tile_dir)
+
+        # tiles of an older world.svg and the single scaled image the
+        # map used to be
+        parent = os.path.dirname(tile_dir)
+        for path in glob.glob(os.path.join(parent, 'tiles-*')):
+            if path != tile_dir:
+                shutil.rmtree(path, ignore_errors=True)
+        for path in glob.glob(os.path.join(parent, 'world-*.png')):
+            os.remove(path)
+
+    def get_path(self, key):
+        return os.path.join(self.tile_dir, '%d-%d-%d.png' % key)
+
+    def get(self, key):
+        """Return the cached surface of a tile, or None."""
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            surface = cairo.ImageSurface.create_from_png(path)
+        except (IOError, MemoryError, cairo.Error):
+            _logger.debug('corrupt map tile %s' % (path))
+            return None
+        os.utime(path, None)
+        return surface
+
+    def put(self, key, surface):
+        # write to a temporary name first so that a half written file is
+        # never picked up by the next launch
+        path = self.get_path(key)
+        fd, temp_path = tempfile.mkstemp(dir=self.tile_dir, suffix='.part')
+        os.close(fd)
+        try:
+            surface.write_to_png(temp_path)
+            size = os.path.getsize(temp_path)
+            try:
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.rename(temp_path, path)
+        except (IOError, OSError, cairo.Error):
+            _logger.debug('could not cache map tile %d-%d-%d' % key)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        if self.size is not None:
+            self.size += size
+        if self.size is None or self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used tiles over the size limit."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.tile_dir):
+            path = os.path.join(self.tile_dir, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_atime, info.st_size, path))
+            total += info.st_size
+
+        entries.sort()
+        for atime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.size = total
+
+class TileRenderer(object):
+    """Render tiles of world.svg on a thread, newest requests first."""
+
+    def __init__(self, cache_dir, ready_callback):
+        self.cache_dir = cache_dir
+        self.ready_callback = ready_callback
+
+        # the tiles the view still wants, replaced on every draw
+        self.wanted = frozenset()
+
+        self._pending = set()
+        self._queue = Queue.LifoQueue()
+
+        thread = threading.Thread(target=self._work)
+        thread.daemon = True
+        thread.start()
+
+    def request(self, key):
+        if key not in self._pending:
+            self._pending.add(key)
+            self._queue.put(key)
+
+    def _work(self):
+        cache = TileCache(get_tile_dir(self.cache_dir))
+        handle = Rsvg.Handle.new_from_file(WORLD_SVG)
+        dimensions = handle.get_dimensions()
+        GLib.idle_add(self.ready_callback, None, None,
+                      (dimensions.width, dimensions.height))
+
+        while True:
+            key = self._queue.get()
+            if key not in self.wanted:
+                GLib.idle_add(self.ready_callback, key, None, None)
+                continue
+
+            surface = cache.get(key)
+            if surface is None:
+                surface = self._render(handle, key)
+                cache.put(key, surface)
+            GLib.idle_add(self.ready_callback, key, surface, None)
+
+    def _render(self, handle, key):
+        zoom, x, y = key
+        unit = 2 ** zoom
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, TILE_SIZE,
+                                     TILE_SIZE)
+        context = cairo.Context(surface)
+        context.set_source_rgb(*BACKGROUND)
+        context.paint()
+        context.scale(unit, unit)
+        context.translate(-float(x * TILE_SIZE) / unit,
+                          -float(y * TILE_SIZE) / unit)
+        handle.render_cairo(context)
+        surface.flush()
+        return surface
+
+    def done(self, key):
+        self._pending.discard(key)
+
+class WorldMap(Gtk.DrawingArea):
+    """World map that can be dragged and zoomed with the scroll wheel.
+
+    Overlays added with add_overlay have draw(world_map, context) called
+    after the tiles are painted, in view pixels. The 'view-changed'
+    signal is emitted when the visible area moves or is zoomed.
+    """
+
+    __gsignals__ = {
+        'view-changed': (GObject.SignalFlags.RUN_FIRST, None, []),
+    }
+
+    def __init__(self, cache_dir):
+        Gtk.DrawingArea.__init__(self)
+
+        # map size in SVG units, known once the render thread loaded it
+        self.map_width = None
+        self.map_height = None
+
+        # SVG units at the top left corner of the view and pixels per unit
+        self.offset_x = 0.0
+        self.offset_y = 0.0
+        self.scale = None
+
+        self.overlays = []
+
+        self._tiles = OrderedDict()
+        self._drag = None
+
+        self.add_events(Gdk.EventMask.BUTTON_PRESS_MASK |
+                        Gdk.EventMask.BUTTON_RELEASE_MASK |
+                        Gdk.EventMask.POINTER_MOTION_MASK |
+                        Gdk.EventMask.SCROLL_MASK)
+        self.connect('draw', self.draw_cb)
+        self.connect('size-allocate', self.size_allocate_cb)
+        self.connect('button-press-event', self.button_press_cb)
+        self.connect('button-release-event', self.button_release_cb)
+        self.connect('motion-notify-event', self.motion_notify_cb)
+        self.connect('scroll-event', self.scroll_cb)
+
+        self.renderer = TileRenderer(cache_dir, self._tile_ready)
+
+    def get_min_scale(self):
+        allocation = self.get_allocation()
+        return min(float(allocation.width) / self.map_width,
+                   float(allocation.height) / self.map_height)
+
+    def get_zoom(self):
+        """Return the level whose tiles are at least as sharp as the view."""
+        zoom = 0
+        while zoom < MAX_ZOOM and 2 ** zoom < self.scale:
+            zoom += 1
+        return zoom
+
+    def to_map(self, x, y):
+        """Convert view pixels to SVG units."""
+        return self.offset_x + x / self.scale, self.offset_y + y / self.scale
+
+    def to_view(self, x, y):
+        """Convert SVG units to view pixels."""
+        return (x - self.offset_x) * self.scale, (y - self.offset_y) * self.scale
+
+    def get_visible(self):
+        """Return the visible area as (x, y, width, height) in SVG units."""
+        allocation = self.get_allocation()
+        return (self.offset_x, self.offset_y,
+                allocation.width / self.scale, allocation.height / self.scale)
+
+    def get_visible_tiles(self):
+        """Return the keys of the tiles in view at the current zoom."""
+        zoom = self.get_zoom()
+        span = float(TILE_SIZE) / 2 ** zoom
+        x, y, width, height = self.get_visible()
+        first_x = max(0, int(x / span))
+        first_y = max(0, int(y / span))
+        last_x = int(min(x + width, self.map_width - 1) / span)
+        last_y = int(min(y + height, self.map_height - 1) / span)
+        return [(zoom, tile_x, tile_y)
+                for tile_y in range(first_y, last_y + 1)
+                for tile_x in range(first_x, last_x + 1)]
+
+    def get_tile_bounds(self, key):
+        """Return the (west, south, east, north) degrees of a tile."""
+        zoom, x, y = key
+        span = float(TILE_SIZE) / 2 ** zoom
+        west, north = unproject(x * span, y * span, self.map_width,
+                                self.map_height)
+        east, south = unproject((x + 1) * span, (y + 1) * span,
+                                self.map_width, self.map_height)
+        return (max(-180.0, west), max(-90.0, south), min(180.0, east),
+                min(90.0, north))
+
+    def add_overlay(self, overlay):
+        self.overlays.append(overlay)
+        self.queue_draw()
+
+    def _view_changed(self):
+        self.queue_draw()
+        self.emit('view-changed')
+
+    def zoom(self, factor, x=None, y=None):
+        """Zoom by factor around a view position, the center by default."""
+        if self.scale is None:
+            return
+        allocation = self.get_allocation()
+        if x is None:
+            x, y = allocation.width / 2.0, allocation.height / 2.0
+
+        map_x, map_y = self.to_map(x, y)
+        self.scale = max(self.get_min_scale(),
+                         min(MAX_SCALE, self.scale * factor))
+        self.offset_x = map_x - x / self.scale
+        self.offset_y = map_y - y / self.scale
+        self._clamp()
+        self._view_changed()
+
+    def zoom_in(self):
+        self.zoom(ZOOM_STEP)
+
+    def zoom_out(self):
+        self.zoom(1 / ZOOM_STEP)
+
+    def _clamp(self):
+        allocation = self.get_allocation()
+        for offset, view_size, map_size in [
+                ('offset_x', allocation.width, self.map_width),
+                ('offset_y', allocation.height, self.map_height)]:
+            span = view_size / self.scale
+            if span >= map_size:
+                value = (map_size - span) / 2
+            else:
+                value = max(0.0, min(map_size - span, getattr(self, offset)))
+            setattr(self, offset, value)
+
+    def size_allocate_cb(self, widget, allocation):
+        if self.map_width is None:
+            return
+        if self.scale is None or self.scale < self.get_min_scale():
+            self.scale = self.get_min_scale()
+        self._clamp()
+        self.emit('view-changed')
+
+    def button_press_cb(self, widget, event):
+        if event.button == 1:
+            self._drag = (event.x, event.y, self.offset_x, self.offset_y)
+        return True
+
+    def button_release_cb(self, widget, event):
+        self._drag = None
+        return True
+
+    def motion_notify_cb(self, widget, event):
+        if self._drag is None or self.scale is None:
+            return False
+        x, y, offset_x, offset_y = self._drag
+        self.offset_x = offset_x - (event.x - x) / self.scale
+        self.offset_y = offset_y - (event.y - y) / self.scale
+        self._clamp()
+        self._view_changed()
+        return True
+
+    def scroll_cb(self, widget, event):
+        if event.direction == Gdk.ScrollDirection.UP:
+            self.zoom(ZOOM_STEP, event.x, event.y)
+        elif event.direction == Gdk.ScrollDirection.DOWN:
+            self.zoom(1 / ZOOM_STEP, event.x, event.y)
+        return True
+
+    def _tile_ready(self, key, surface, size):
+        if size is not None:
+            self.map_width, self.map_height = size
+            self.size_allocate_cb(self, self.get_allocation())
+            self.queue_draw()
+            return False
+
+        self.renderer.done(key)
+        if surface is not None:
+            self._tiles[key] = surface
+            while len(self._tiles) > MEMORY_TILES:
+                self._tiles.popitem(last=False)
+            self.queue_draw()
+        return False
+
+    def _get_tile(self, key):
+        surface = self._tiles.pop(key, None)
+        if surface is not None:
+            self._tiles[key] = surface
+        return surface
+
+    def draw_cb(self, widget, context):
+        context.set_source_rgb(*BACKGROUND)
+        context.paint()
+        if self.scale is None:
+            return False
+
+        context.save()
+        context.scale(self.scale, self.scale)
+        context.translate(-self.offset_x, -self.offset_y)
+
+        wanted = set()
+        for key in self.get_visible_tiles():
+            if not self._paint_tile(context, key):
+                wanted.add(key)
+        context.restore()
+
+        self.renderer.wanted = frozenset(wanted)
+        for key in wanted:
+            self.renderer.request(key)
+
+        for overlay in self.overlays:
+            overlay.draw(self, context)
+        return False
+
+    def _paint_tile(self, context, key):
+        """Paint a tile, or the part of a coarser one that covers it.
+
+        Returns whether the tile itself was painted.
+        """
+        zoom, x, y = key
+        span = float(TILE_SIZE) / 2 ** zoom
+
+        level, tile_x, tile_y = key
+        while level >= 0:
+            surface = self._get_tile((level, tile_x, tile_y))
+            if surface is not None:
+                unit = 2 ** level
+                context.save()
+                context.rectangle(x * span, y * span, span, span)
+                context.clip()
+                context.translate(float(tile_x * TILE_SIZE) / unit,
+                                  float(tile_y * TILE_SIZE) / unit)
+                context.scale(1.0 / unit, 1.0 / unit)
+                context.set_source_surface(surface, 0, 0)
+                context.paint()
+                context.restore()
+                return level == zoom
+            level, tile_x, tile_y = level - 1, tile_x / 2, tile_y / 2
+        return False